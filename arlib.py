@@ -2,14 +2,25 @@
 #   https://www.freebsd.org/cgi/man.cgi?query=ar&sektion=5&apropos=0&manpath=FreeBSD+10.1-RELEASE
 #   http://www.opensource.apple.com/source/cctools/cctools-795/include/mach-o/ranlib.h
 
+import io
 import os
 import re
+import mmap
+import errno
+import bisect
+import json
+import hashlib
 import sys
 import time
 import string
 import struct
 import shutil
 import logging
+import tempfile
+import threading
+from array import array
+from multiprocessing.pool import ThreadPool
+from collections import deque, namedtuple, OrderedDict
 
 GNU = 0
 BSD = 1
@@ -22,20 +33,45 @@ _FORMATNAMES = {
     DEB: "DEB"
 }
 
-_BLOCKSIZE = 65535
+_BLOCKSIZE = 1 << 16
+_POOLSIZE = 4
+# Saving queues writes of up to _GATHERSIZE bytes and hands them to
+# writev() together, at most _IOV_MAX buffers or _GATHERLIMIT bytes at once.
+_GATHERSIZE = _BLOCKSIZE
+_GATHERLIMIT = 16 * _BLOCKSIZE
+try:
+    _IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = -1
+if _IOV_MAX <= 0:
+    _IOV_MAX = 1024
+# Header offsets from which a GNU symbol table needs 64-bit entries.
+_SYM64_OFFSET = 1 << 32
+
+# Errors from copy_file_range() and sendfile() that mean the pair of files
+# is not supported and a slower method should be used instead.
+_COPY_FALLBACK_ERRNOS = set(getattr(errno, name) for name in
+    ("EXDEV", "EINVAL", "ENOSYS", "EOPNOTSUPP", "ENOTSUP", "EBADF", "EPERM", "ETXTBSY", "ESPIPE")
+    if hasattr(errno, name))
 _WHITESPACERE = re.compile(r"[\s]")
+_NAMESTRIP = b" \t\n\r\x0b\x0c\x00"
 
 log = logging.getLogger("arlib")
 
 import sys
 if sys.version_info >= (3, 0):
     isstring = lambda v: isinstance(v, str)
-    tobytes = bytes
-    tostr = str
+    tobytes = lambda s, e, errors="strict": bytes(s, e, errors)
+    tostr = lambda v, e, errors="strict": str(v, e, errors)
+    _INT64 = "q"
+    _UINT_TYPECODES = "ILQ"
 else:
     isstring = lambda v: isinstance(v, str) or isinstance(v, unicode)
-    tobytes = lambda s, e: bytes(s)
-    tostr = lambda v, e: str(v)
+    tobytes = lambda s, e, errors="strict": bytes(s)
+    tostr = lambda v, e, errors="strict": str(v)
+    # Python 2 arrays have no "q" or "Q"; "l" and "L" are 64 bits on LP64 platforms.
+    _INT64 = "l"
+    _UINT_TYPECODES = "IL"
 
 class WrongMemberTypeException(Exception):
     pass
@@ -43,17 +79,508 @@ class WrongMemberTypeException(Exception):
 class InvalidArchiveException(Exception):
     pass
 
+# A member header as read from an archive: the stripped name field, the
+# BSD "#1/" long name that follows the header (or None), the raw numeric
+# fields, the payload size and the offsets of the payload and of the end
+# of the member. Headers replayed from an index cache also carry the
+# resolved name of GNU long members as longname, and an empty longname for
+# the GNU string table, whose contents are then not needed.
+_MemberHeader = namedtuple("_MemberHeader", "name longname date uid gid mode size offset end")
+
+# Member classes keyed on the kind of name field they are read from, and
+# every registered class in registration order.
+_MEMBER_TYPES = {}
+_MEMBER_CLASSES = []
+
+def register_member_type(cls):
+    """Class decorator registering an ArchiveMember subclass.
+
+    Classes with a ``header_key`` are used by Archive.read_member() for
+    headers of that kind; every registered class is tried, in registration
+    order, by Archive.add() for files of its format.
+    """
+    if cls.header_key is not None:
+        _MEMBER_TYPES[cls.header_key] = cls
+    _MEMBER_CLASSES.append(cls)
+    return cls
+
+def _fileno(fileobj):
+    try:
+        return fileobj.fileno()
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        return None
+
+def _kernel_copy(copier, infd, offset, outfd, length):
+    """Copies with copy_file_range() or sendfile() until done, EOF or an unsupported pair of files."""
+    copied = 0
+    try:
+        while copied < length:
+            n = copier(infd, offset + copied, outfd, length - copied)
+            if n == 0:
+                break
+            copied += n
+    except OSError as e:
+        if e.errno not in _COPY_FALLBACK_ERRNOS:
+            raise
+        log.debug("Kernel copy unavailable: %s", e)
+    return copied
+
+if hasattr(os, "copy_file_range"):
+    _copy_file_range = lambda infd, offset, outfd, count: os.copy_file_range(infd, outfd, count, offset)
+else:
+    _copy_file_range = None
+
+if hasattr(os, "preadv"):
+    _pread_into = lambda fd, buf, offset: os.preadv(fd, [buf], offset)
+elif hasattr(os, "pread"):
+    def _pread_into(fd, buf, offset):
+        data = os.pread(fd, len(buf), offset)
+        buf[:len(data)] = data
+        return len(data)
+else:
+    _pread_into = None
+
+if hasattr(os, "pwrite"):
+    _pwrite = os.pwrite
+else:
+    # Seeking first is only safe from one thread; parallel writers check
+    # for os.pwrite themselves.
+    def _pwrite(fd, data, offset):
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.write(fd, memoryview(data).tobytes())
+
+if hasattr(os, "sendfile"):
+    _sendfile = lambda infd, offset, outfd, count: os.sendfile(outfd, infd, offset, count)
+else:
+    _sendfile = None
+
+class _BufferPool(object):
+    """A small thread-safe pool of reusable, page-aligned copy buffers.
+
+    Buffers are anonymous memory mappings, rounded up to a whole number of
+    pages, handed out as memoryviews. At most size buffers are kept for
+    reuse; any beyond that are allocated on demand and dropped on release.
+    """
+
+    def __init__(self, blocksize=_BLOCKSIZE, size=_POOLSIZE):
+        self.blocksize = max(mmap.PAGESIZE, (blocksize + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE)
+        self.size = size
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        try:
+            return memoryview(mmap.mmap(-1, self.blocksize))
+        except TypeError:
+            # Python 2 mappings have no buffer interface for memoryview.
+            return memoryview(bytearray(self.blocksize))
+
+    def release(self, buf):
+        with self._lock:
+            if len(self._free) < self.size:
+                self._free.append(buf)
+                return
+        if hasattr(buf, "release"):
+            buf.release()
+
+class Reader(object):
+    """Positional access to the bytes of an archive.
+
+    Readers never depend on a shared file position, so several threads can
+    read members of one archive at once. Subclasses implement
+    readinto_at(); fileno() returns a descriptor usable for kernel copies,
+    or None.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def fileno(self):
+        return None
+
+    def read_at(self, offset, length):
+        buf = bytearray(length)
+        n = self.readinto_at(buf, offset)
+        return bytes(buf[:n])
+
+    def readinto_at(self, buf, offset):
+        raise NotImplementedError("The method readinto_at() must be implemented in derived classes.")
+
+class FileReader(Reader):
+    """Reads a file with pread(), leaving its file position alone."""
+
+    def __init__(self, fileobj):
+        super(FileReader, self).__init__(fileobj)
+        self._fd = fileobj.fileno()
+
+    def fileno(self):
+        return self._fd
+
+    def read_at(self, offset, length):
+        data = os.pread(self._fd, length, offset)
+        if 0 < len(data) < length:
+            chunks = [data]
+            while length > 0 and data:
+                offset += len(data)
+                length -= len(data)
+                data = os.pread(self._fd, length, offset)
+                chunks.append(data)
+            data = b"".join(chunks)
+        return data
+
+    def readinto_at(self, buf, offset):
+        return _pread_into(self._fd, buf, offset)
+
+class MappedReader(Reader):
+    """Reads a memory mapping; view() returns slices of it without copying."""
+
+    def view(self, offset, length):
+        try:
+            return memoryview(self.fileobj)[offset:offset + length]
+        except TypeError:
+            # Python 2 mappings have no buffer interface; the slice is a copy.
+            return memoryview(self.fileobj[offset:offset + length])
+
+    def read_at(self, offset, length):
+        return self.fileobj[offset:offset + length]
+
+    def readinto_at(self, buf, offset):
+        n = max(0, min(len(buf), len(self.fileobj) - offset))
+        buf[:n] = self.view(offset, n)
+        return n
+
+class StreamReader(Reader):
+    """Reads any seekable file object, holding a lock around each seek and read."""
+
+    def __init__(self, fileobj):
+        super(StreamReader, self).__init__(fileobj)
+        self._lock = threading.Lock()
+
+    def read_at(self, offset, length):
+        with self._lock:
+            self.fileobj.seek(offset)
+            return self.fileobj.read(length)
+
+    def readinto_at(self, buf, offset):
+        if not hasattr(self.fileobj, "readinto"):
+            data = self.read_at(offset, len(buf))
+            buf[:len(data)] = data
+            return len(data)
+        with self._lock:
+            self.fileobj.seek(offset)
+            return self.fileobj.readinto(buf)
+
+class ForwardReader(Reader):
+    """Reads a non-seekable stream, such as a pipe or socket, in one pass.
+
+    Reads must come in increasing order of offset. Data skipped over is
+    read and discarded, and reading before the current position raises
+    io.UnsupportedOperation.
+    """
+
+    def __init__(self, fileobj):
+        super(ForwardReader, self).__init__(fileobj)
+        self._position = _tell(fileobj)
+        self._lock = threading.Lock()
+
+    def _skip_to(self, offset):
+        if offset < self._position:
+            raise io.UnsupportedOperation("Cannot read offset {0} of a stream already at {1}".format(
+                offset, self._position))
+        while self._position < offset:
+            data = self.fileobj.read(min(offset - self._position, _BLOCKSIZE))
+            if not data:
+                break
+            self._position += len(data)
+
+    def read_at(self, offset, length):
+        with self._lock:
+            self._skip_to(offset)
+            chunks = []
+            while length > 0:
+                data = self.fileobj.read(length)
+                if not data:
+                    break
+                chunks.append(data)
+                length -= len(data)
+                self._position += len(data)
+            return b"".join(chunks)
+
+    def readinto_at(self, buf, offset):
+        data = self.read_at(offset, len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+def _tell(fileobj):
+    try:
+        return fileobj.tell()
+    except (IOError, OSError, AttributeError):
+        return 0
+
+def _stat_key(st):
+    mtime_ns = getattr(st, "st_mtime_ns", None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return [st.st_dev, st.st_ino, st.st_size, mtime_ns]
+
+def make_reader(fileobj):
+    """Returns the Reader best suited to a file object or memory mapping."""
+    if isinstance(fileobj, mmap.mmap):
+        return MappedReader(fileobj)
+    if _pread_into is not None and _fileno(fileobj) is not None:
+        return FileReader(fileobj)
+    return StreamReader(fileobj)
+
+class _GatherWriter(object):
+    """Writes to the descriptor of a file object with vectored writes.
+
+    Small writes are queued and written together with a single writev()
+    once _IOV_MAX buffers or _GATHERLIMIT bytes are waiting, or when
+    flush() is called. The file object is flushed first, and the position
+    is tracked so tell() needs no system call while writes are queued.
+    """
+
+    def __init__(self, fileobj):
+        fileobj.flush()
+        self.fileobj = fileobj
+        self.fd = fileobj.fileno()
+        self._iov = []
+        self._queued = 0
+        self._position = None
+
+    def fileno(self):
+        return self.fd
+
+    def tell(self):
+        if self._position is None:
+            self._position = os.lseek(self.fd, 0, os.SEEK_CUR)
+        return self._position + self._queued
+
+    def write(self, data):
+        if self._position is None:
+            self._position = os.lseek(self.fd, 0, os.SEEK_CUR)
+        if len(data) == 0:
+            return 0
+        self._iov.append(data)
+        self._queued += len(data)
+        if len(self._iov) >= _IOV_MAX or self._queued >= _GATHERLIMIT:
+            self.drain()
+        return len(data)
+
+    def drain(self):
+        """Writes everything queued, after which written buffers may be reused."""
+        iov = self._iov
+        while iov:
+            n = os.writev(self.fd, iov)
+            self._position += n
+            self._queued -= n
+            while iov and n >= len(iov[0]):
+                n -= len(iov[0])
+                iov.pop(0)
+            if n:
+                iov[0] = memoryview(iov[0])[n:]
+
+    def flush(self):
+        """Writes everything queued. The position may then be moved by writes to the descriptor."""
+        self.drain()
+        self._position = None
+
+def _copy_range(reader, offset, outfile, length, buffers=None):
+    """Copies length bytes at offset of reader to the current position of outfile.
+
+    When both ends are files the copy is done in the kernel, with
+    copy_file_range() (which can reflink on filesystems such as btrfs and
+    XFS) and then sendfile(). Mapped input is written from the mapping
+    directly. Copies of up to _GATHERSIZE bytes into a _GatherWriter are
+    read and queued so they share a writev() with the headers around them.
+    Anything else is read into a buffer taken from buffers, a _BufferPool,
+    so that steady-state copying allocates nothing.
+    """
+    if length <= 0:
+        return
+    if isinstance(reader, MappedReader):
+        outfile.write(reader.view(offset, length))
+        return
+    if isinstance(outfile, _GatherWriter) and length <= _GATHERSIZE:
+        outfile.write(reader.read_at(offset, length))
+        return
+
+    infd = reader.fileno()
+    outfd = _fileno(outfile)
+    if infd is not None and outfd is not None:
+        outfile.flush()
+        for copier in (_copy_file_range, _sendfile):
+            if copier is not None and length > 0:
+                copied = _kernel_copy(copier, infd, offset, outfd, length)
+                offset += copied
+                length -= copied
+        if length == 0:
+            return
+
+    if buffers is None:
+        buffers = _BufferPool(min(length, _BLOCKSIZE), 0)
+    buf = buffers.acquire()
+    try:
+        while length > 0:
+            chunk = buf if length >= len(buf) else buf[:length]
+            n = reader.readinto_at(chunk, offset)
+            if not n:
+                return
+            outfile.write(chunk if n == len(chunk) else chunk[:n])
+            if isinstance(outfile, _GatherWriter):
+                outfile.drain()
+            offset += n
+            length -= n
+    finally:
+        buffers.release(buf)
+
+def _unpack_uints(data, size, byteorder="big"):
+    """Decodes a run of unsigned integers of size bytes and the given byte order into an array."""
+    typecode = [code for code in _UINT_TYPECODES if array(code).itemsize == size][0]
+    values = array(typecode)
+    if hasattr(values, "frombytes"):
+        values.frombytes(data)
+    else:
+        values.fromstring(bytes(data))
+    if sys.byteorder != byteorder:
+        values.byteswap()
+    return values
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while len(view):
+        n = _pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+def _copy_range_at(reader, offset, outfd, outoffset, length, buffers=None):
+    """Copies length bytes at offset of reader to outoffset of the descriptor outfd.
+
+    Like _copy_range(), but only positional writes are used, so several
+    threads can fill different parts of one file at once. sendfile()
+    writes at the file position and is not used.
+    """
+    if length <= 0:
+        return
+    if isinstance(reader, MappedReader):
+        _pwrite_all(outfd, reader.view(offset, length), outoffset)
+        return
+
+    infd = reader.fileno()
+    if infd is not None and _copy_file_range is not None:
+        start = offset
+        copier = lambda infd, inoffset, outfd, count: os.copy_file_range(
+            infd, outfd, count, inoffset, outoffset + inoffset - start)
+        copied = _kernel_copy(copier, infd, offset, outfd, length)
+        offset += copied
+        outoffset += copied
+        length -= copied
+        if length == 0:
+            return
+
+    if buffers is None:
+        buffers = _BufferPool(min(length, _BLOCKSIZE), 0)
+    buf = buffers.acquire()
+    try:
+        while length > 0:
+            chunk = buf if length >= len(buf) else buf[:length]
+            n = reader.readinto_at(chunk, offset)
+            if not n:
+                return
+            _pwrite_all(outfd, chunk[:n], outoffset)
+            offset += n
+            outoffset += n
+            length -= n
+    finally:
+        buffers.release(buf)
+
+class MemberFile(io.RawIOBase):
+    """A read-only file object over the payload of an archive member.
+
+    Reads go through the archive's Reader at positions bounded to the
+    payload, so the file can be handed to tarfile, ELF parsers and the like
+    without extracting or copying the member. It is seekable unless the
+    archive is being streamed.
+    """
+
+    def __init__(self, member):
+        super(MemberFile, self).__init__()
+        self.member = member
+        self.name = member.filename
+        self._reader = member.archive.reader
+        self._offset = member.offset
+        self._size = member.filesize
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return not isinstance(self._reader, ForwardReader)
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if not self.seekable():
+            raise io.UnsupportedOperation("Member of a streamed archive is not seekable")
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        elif whence != io.SEEK_SET:
+            raise ValueError("Invalid whence ({0})".format(whence))
+        if offset < 0:
+            raise ValueError("Negative seek position {0}".format(offset))
+        self._position = offset
+        return offset
+
+    def readinto(self, buf):
+        n = min(len(buf), self._size - self._position)
+        if n <= 0:
+            return 0
+        n = self._reader.readinto_at(memoryview(buf)[:n], self._offset + self._position)
+        self._position += n
+        return n
+
+    def readall(self):
+        n = self._size - self._position
+        if n <= 0:
+            return b""
+        data = self._reader.read_at(self._offset + self._position, n)
+        self._position += len(data)
+        return data
+
 class ArchiveMember(object):
+    __slots__ = ("_name", "_namestr", "_filename", "_filenamestr", "_size", "_offset", "archive", "sourcedir",
+                 "date", "uid", "gid", "mode")
+
     format = None
     normal = True
+    header_key = None
 
     _header_format = struct.Struct("=16s12s6s6s8s10s2s")
     _header_fill = b" "
     _header_tail = b"`\n"
+    # Writing packs the name, then all of the numeric fields formatted at
+    # once; each field is checked against its width before formatting.
+    _header_packer = struct.Struct("=16s42s2s")
+    _header_numbers = b"%-12d%-6d%-6d%-8o%-10d"
+    _header_widths = (("date", 12, 10), ("uid", 6, 10), ("gid", 6, 10), ("mode", 8, 8), ("size", 10, 10))
 
-    def __init__(self, archive, path=None):
+    def __init__(self, archive, path=None, header=None):
         self._name = None
+        self._namestr = None
         self._filename = None
+        self._filenamestr = None
         self._size = 0
         self._offset = None
 
@@ -62,34 +589,46 @@ class ArchiveMember(object):
         if path:
             self.init_from_file(path)
         else:
-            self.init_from_archive()
+            if header is None:
+                header = archive._next_header()
+                if header is None:
+                    raise EOFError()
+            self.init_from_archive(header)
 
     def __repr__(self):
         return "<{0}(filename={1}, sourcedir={2}, name={3}, date={4}, uid={5}, gid={6}, mode=0{7:04o}, size={8})>".format(
             self.__class__.__name__, self.filename, self.sourcedir, self.name, self.date, self.uid, self.gid, self.mode, self.size)
 
+    # Only the encoded name, which is what gets written, is stored by the
+    # setters; the decoded form is cached on first access and dropped
+    # whenever the setter replaces the bytes.
     @property
     def name(self):
-        if isinstance(self._name, bytes):
-            return tostr(self._name, self.archive.encoding)
-        return self._name
+        if self._namestr is None and self._name is not None:
+            self._namestr = tostr(self._name, self.archive.encoding, self.archive.errors)
+        return self._namestr
     @name.setter
     def name(self, value):
         if isstring(value):
-            value = tobytes(value, self.archive.encoding)
+            value = tobytes(value, self.archive.encoding, self.archive.errors)
+        self._namestr = None
         self._name = value
 
     @property
     def filename(self):
-        if isinstance(self._filename, bytes):
-            return tostr(self._filename, self.archive.encoding)
-        return self._filename
+        if self._filenamestr is None and self._filename is not None:
+            self._filenamestr = tostr(self._filename, self.archive.encoding, self.archive.errors)
+        return self._filenamestr
     @filename.setter
     def filename(self, value):
+        previous = self._filename
         if isstring(value):
             value = value.strip(string.whitespace + "\x00")
-            value = tobytes(value, self.archive.encoding)
+            value = tobytes(value, self.archive.encoding, self.archive.errors)
+        self._filenamestr = None
         self._filename = value
+        if previous is not None and previous != value:
+            self.archive._renamed(self, tostr(previous, self.archive.encoding, self.archive.errors))
 
     @property
     def size(self):
@@ -112,6 +651,13 @@ class ArchiveMember(object):
     def offset(self, value):
         self._offset = value
 
+    @property
+    def header_offset(self):
+        """The offset of the header of the member in the archive, or None for members added from files."""
+        if self.offset is None or self.sourcedir is not None:
+            return None
+        return self.offset - self._header_packer.size - (self.size - self.filesize)
+
     def init_from_file(self, path):
         prop = os.stat(path)
 
@@ -124,31 +670,18 @@ class ArchiveMember(object):
         self.filesize = prop.st_size
         self.offset = None
 
-    def init_from_archive(self):
-        header = self.archive.instream.read(self._header_format.size)
-        if len(header) < self._header_format.size:
-            raise EOFError()
-        nameinfo, date, uid, gid, mode, size, tail = self._header_format.unpack(header)
-        log.debug("Read header values: %s, %s, %s, %s, %s, %s",
-            nameinfo.strip(), date.strip(), uid.strip(), gid.strip(), mode.strip(), size.strip())
-        assert tail == self._header_tail
-
-        self.set_name_from_archive(nameinfo.decode(self.archive.encoding).strip())
+    def init_from_archive(self, header):
+        self.set_name_from_archive(header.name)
         self.sourcedir = None
-        self.date = int(date.decode(self.archive.encoding).strip())
-        self.uid = int(uid.decode(self.archive.encoding).strip())
-        self.gid = int(gid.decode(self.archive.encoding).strip())
-        self.mode = int(mode.decode(self.archive.encoding).strip(), 8)
-        self.size = int(size.decode(self.archive.encoding).strip())
-        self.offset = self.archive.instream.tell()
-
-    @classmethod
-    def derived(cls):
-        classes = []
-        for c in cls.__subclasses__():
-            classes.append(c)
-            classes += c.derived()
-        return set(classes)
+        try:
+            self.date = int(header.date)
+            self.uid = int(header.uid)
+            self.gid = int(header.gid)
+            self.mode = int(header.mode, 8)
+        except ValueError:
+            raise InvalidArchiveException("Invalid header for member '{0}'".format(header.name))
+        self.size = header.size
+        self.offset = header.offset
 
     def set_name_from_file(self, filename):
         raise NotImplementedError("The method set_name_from_file() must be implemented in derived classes.")
@@ -156,16 +689,43 @@ class ArchiveMember(object):
     def set_name_from_archive(self, nameinfo):
         raise NotImplementedError("The method set_name_from_archive() must be implemented in derived classes.")
 
-    def write_header(self):
-        name = self.name.encode(self.archive.encoding).ljust(16)
-        date = str(self.date).encode(self.archive.encoding).ljust(12)
-        uid = str(self.uid).encode(self.archive.encoding).ljust(6)
-        gid = str(self.gid).encode(self.archive.encoding).ljust(6)
-        mode = "{0:o}".format(self.mode).encode(self.archive.encoding).ljust(8)
-        size = str(self.size).encode(self.archive.encoding).ljust(10)
-
-        packed = self._header_format.pack(name, date, uid, gid, mode, size, self._header_tail)
-        self.archive.outstream.write(packed)
+    def header_values(self):
+        """Returns the encoded name and the numeric fields of the header.
+
+        Raises InvalidArchiveException when a value does not fit its field.
+        """
+        name = self._name
+        if name is None:
+            name = tobytes(self.name, self.archive.encoding, self.archive.errors)
+        if len(name) > 16:
+            raise InvalidArchiveException("Name of member '{0}' does not fit in 16 bytes".format(self.name))
+        values = []
+        for field, width, base in self._header_widths:
+            value = getattr(self, field)
+            if not 0 <= value < base ** width:
+                raise InvalidArchiveException("Field {0} of member '{1}' does not fit in {2} digits: {3}".format(
+                    field, self.name, width, value))
+            values.append(value)
+        return name, tuple(values)
+
+    def pack_header(self, buf, offset=0, values=None):
+        """Packs the 60 byte header into buf at offset."""
+        name, numbers = values if values is not None else self.header_values()
+        self._header_packer.pack_into(buf, offset, name.ljust(16), self._header_numbers % numbers,
+                                      self._header_tail)
+
+    def header_extra(self):
+        """Returns the bytes written between the header and the payload."""
+        return b""
+
+    def write_header(self, header=None):
+        if header is None:
+            header = bytearray(self._header_packer.size)
+            self.pack_header(header)
+        self.archive.outstream.write(header)
+        extra = self.header_extra()
+        if extra:
+            self.archive.outstream.write(extra)
 
     def extract(self, path):
         path = os.path.abspath(path)
@@ -176,16 +736,7 @@ class ArchiveMember(object):
             except OSError:
                 pass
             with open(filepath, "wb") as outfile:
-                infile = self.archive.instream
-                infile.seek(self.offset)
-                remaining = self.filesize
-                while remaining >= _BLOCKSIZE:
-                    buf = infile.read(_BLOCKSIZE)
-                    outfile.write(buf)
-                    remaining -= _BLOCKSIZE
-                if remaining > 0:
-                    buf = infile.read(remaining)
-                    outfile.write(buf)
+                _copy_range(self.archive.reader, self.offset, outfile, self.filesize, self.archive.buffers)
             os.chmod(filepath, self.mode)
             try:
                 os.chown(filepath, self.uid, self.gid)
@@ -197,37 +748,73 @@ class ArchiveMember(object):
             externalfile = os.path.join(externaldir, self.filename)
             shutil.copy2(externalfile, filepath)
 
+    def payload(self):
+        """Returns the contents to write for a member generated in memory, or None to copy its data."""
+        return None
+
     def collect(self):
+        """Writes the payload of the member to the output stream of the archive.
+
+        The member keeps reading from where it was loaded or added from.
+        """
         outfile = self.archive.outstream
-        newoffset = outfile.tell()
-        infile = None
-        if self.sourcedir is None:
-            infile = self.archive.instream
-            infile.seek(self.offset)
+        payload = self.payload()
+        if payload is not None:
+            outfile.write(payload)
+        elif self.sourcedir is None:
+            _copy_range(self.archive.reader, self.offset, outfile, self.filesize, self.archive.buffers)
         else:
             externaldir = os.path.abspath(self.sourcedir)
             externalfile = os.path.join(externaldir, self.filename)
-            infile = open(externalfile, "rb")
-
-        remaining = self.filesize
-        while remaining >= _BLOCKSIZE:
-            buf = infile.read(_BLOCKSIZE)
-            outfile.write(buf)
-            remaining -= _BLOCKSIZE
-        if remaining > 0:
-            buf = infile.read(remaining)
-            outfile.write(buf)
-        infile.close()
-        self.offset = newoffset
-        self.sourcedir = None
+            with open(externalfile, "rb") as infile:
+                _copy_range(make_reader(infile), 0, outfile, self.filesize, self.archive.buffers)
+
+    def collect_at(self, fd, offset):
+        """Like collect(), but writes the payload at offset of the descriptor fd with positional writes."""
+        payload = self.payload()
+        if payload is not None:
+            _pwrite_all(fd, payload, offset)
+        elif self.sourcedir is None:
+            _copy_range_at(self.archive.reader, self.offset, fd, offset, self.filesize, self.archive.buffers)
+        else:
+            externaldir = os.path.abspath(self.sourcedir)
+            externalfile = os.path.join(externaldir, self.filename)
+            with open(externalfile, "rb") as infile:
+                _copy_range_at(make_reader(infile), 0, fd, offset, self.filesize, self.archive.buffers)
+
+    def view(self):
+        """Returns the payload of the member as a memoryview.
+
+        For archives loaded with use_mmap the view aliases the mapping and no
+        bytes are copied; the mapping cannot be closed while views exist.
+        Otherwise the payload is read into memory.
+        """
+        if self.sourcedir is None:
+            reader = self.archive.reader
+            if isinstance(reader, MappedReader):
+                return reader.view(self.offset, self.filesize)
+            return memoryview(reader.read_at(self.offset, self.filesize))
+        externalfile = os.path.join(os.path.abspath(self.sourcedir), self.filename)
+        with open(externalfile, "rb") as infile:
+            return memoryview(infile.read())
+
+    def open(self):
+        """Returns a read-only, seekable file object over the payload of the member."""
+        if self.sourcedir is None:
+            return MemberFile(self)
+        return open(os.path.join(os.path.abspath(self.sourcedir), self.filename), "rb")
 
+@register_member_type
 class GNUShortMember(ArchiveMember):
+    __slots__ = ()
+
     format = GNU
+    header_key = "<name>/"
 
     _name_terminal = "/"
 
     def set_name_from_file(self, filename):
-        if len(filename.encode(self.archive.encoding)) < 16 and not _WHITESPACERE.search(filename):
+        if len(tobytes(filename, self.archive.encoding, self.archive.errors)) < 16 and not _WHITESPACERE.search(filename):
             self.filename = filename
             self.name = filename + self._name_terminal
         else:
@@ -241,8 +828,12 @@ class GNUShortMember(ArchiveMember):
         else:
             raise WrongMemberTypeException("Not a short GNU archive member.")
 
+@register_member_type
 class GNULongMember(ArchiveMember):
+    __slots__ = ()
+
     format = GNU
+    header_key = "/<digits>"
 
     _name_prefix = "/"
     _name_re = re.compile(r"^/(\d+)$")
@@ -254,40 +845,113 @@ class GNULongMember(ArchiveMember):
 
     @property
     def filename(self):
-        value = self.archive.strings[self]
-        if isinstance(value, bytes):
-            return tostr(value, self.archive.encoding)
-        return value
+        return ArchiveMember.filename.fget(self)
     @filename.setter
     def filename(self, value):
-        if isstring(value):
-            value = value.strip(string.whitespace + "\x00")
-            value = tobytes(value, self.archive.encoding)
-        self.archive.strings[self] = value
+        ArchiveMember.filename.fset(self, value)
+        self.archive.strings[self] = self._filename
 
     def set_name_from_file(self, filename):
-        if len(filename.encode(self.archive.encoding)) >= 16 or _WHITESPACERE.search(filename):
+        if len(tobytes(filename, self.archive.encoding, self.archive.errors)) >= 16 or _WHITESPACERE.search(filename):
             self.filename = filename
         else:
             raise WrongMemberTypeException("Not a long GNU archive member.")
 
-    def set_name_from_archive(self, nameinfo):
-        m = self._name_re.match(nameinfo)
-        if m:
-            offset = int(m.group(1))
-            self.archive.strings.map(self, offset)
+    def init_from_archive(self, header):
+        super(GNULongMember, self).init_from_archive(header)
+        if header.longname is not None:
+            self.filename = header.longname
         else:
+            self.archive.strings.map(self, int(self._name_re.match(header.name).group(1)))
+
+    def set_name_from_archive(self, nameinfo):
+        if not self._name_re.match(nameinfo):
             raise WrongMemberTypeException("Not a long GNU archive member.")
 
-class GNUSymbolTable(ArchiveMember):
-    format = GNU
+class _SymbolTable(ArchiveMember):
+    """The parts shared by the GNU and BSD symbol tables, which decode their payload in entries()."""
+    __slots__ = ("_symbols", "_entries", "_payload")
+
     normal = False
 
+    def __init__(self, archive, path=None, header=None):
+        self._symbols = None
+        self._entries = None
+        self._payload = None
+        super(_SymbolTable, self).__init__(archive, path, header)
+        self.archive.symbols = self
+
+    def symbol_map(self):
+        """Returns a dict from each symbol of the table to the member defining it.
+
+        The table is read and decoded on first use. Where a symbol is listed
+        more than once the first member wins, as it does for a linker.
+        """
+        if self._symbols is None:
+            self._symbols = self.archive._resolve_symbols(*self.entries())
+        return self._symbols
+
+    def entries(self):
+        """Returns the member header offsets and the names, as bytes, of the symbols in table order."""
+        raise NotImplementedError("The method entries() must be implemented in derived classes.")
+
+    def find(self, symbol, default=None):
+        """Returns the member defining symbol, or default."""
+        return self.symbol_map().get(symbol, default)
+
+    def payload(self):
+        return self._payload
+
+@register_member_type
+class GNUSymbolTable(_SymbolTable):
+    __slots__ = ()
+
+    format = GNU
+    header_key = "/"
+
     _name_literal = "/"
+    _count_format = struct.Struct(">I")
+    _offset_code = "I"
+    _offset_size = 4
 
-    def __init__(self, archive, path=None):
-        super(GNUSymbolTable, self).__init__(archive, path)
-        self.archive.symbols = self
+    @classmethod
+    def parse(cls, data):
+        """Returns the member offsets, as an array, and the symbol names of the payload of a table.
+
+        The table is a big-endian symbol count, one big-endian offset of a
+        member header per symbol, then the NUL-terminated symbol names.
+        """
+        countsize = cls._count_format.size
+        if len(data) < countsize:
+            raise InvalidArchiveException("Truncated symbol table.")
+        count, = cls._count_format.unpack_from(data, 0)
+        end = countsize + count * cls._offset_size
+        if end > len(data):
+            raise InvalidArchiveException("Truncated symbol table.")
+        offsets = _unpack_uints(data[countsize:end], cls._offset_size)
+        names = bytes(data[end:]).split(b"\0", count)
+        if len(names) <= count:
+            raise InvalidArchiveException("Symbol table lists {0} symbols but names {1}.".format(count, len(names) - 1))
+        return offsets, names[:count]
+
+    def entries(self):
+        if self._payload is not None:
+            return self.parse(self._payload)
+        if self._entries is not None:
+            return self._entries
+        if self.offset is None or self.sourcedir is not None:
+            return [], []
+        return self.parse(self.archive.reader.read_at(self.offset, self.filesize))
+
+    def build(self, entries):
+        """Replaces the table with entries, a list of (symbol name as bytes, member header offset) pairs."""
+        count = len(entries)
+        offsets = struct.pack(">%d%s" % (count, self._offset_code), *[offset for name, offset in entries])
+        names = b"".join(name + b"\0" for name, offset in entries)
+        self._payload = self._count_format.pack(count) + offsets + names
+        self.filesize = len(self._payload)
+        self._symbols = None
+        self._entries = None
 
     def init_from_file(self, path):
         if path == True:
@@ -315,32 +979,53 @@ class GNUSymbolTable(ArchiveMember):
         else:
             raise WrongMemberTypeException("Not a GNU symbol table archive member.")
 
+@register_member_type
+class GNUSymbolTable64(GNUSymbolTable):
+    """The /SYM64/ symbol table, with a 64-bit count and offsets, used once member offsets pass 4 GiB."""
+    __slots__ = ()
+
+    header_key = "/SYM64/"
+
+    _name_literal = "/SYM64/"
+    _count_format = struct.Struct(">Q")
+    _offset_code = "Q"
+    _offset_size = 8
+
+@register_member_type
 class GNUStringTable(ArchiveMember):
+    __slots__ = ("_items", "_slots", "_lengths", "_tree", "_total", "_data", "_names")
+
     format = GNU
+    header_key = "//"
     normal = False
 
     _delimiter = b"/\n"
     _name_literal = "//"
 
-    def __init__(self, archive, path=None):
-        self._items = {}
-        self._order = []
-        super(GNUStringTable, self).__init__(archive, path)
+    def __init__(self, archive, path=None, header=None):
+        # Entries in the order they are written. Each entry has a slot, in
+        # order of addition, and the lengths of the slots are summed in a
+        # Fenwick tree, so the offset of an entry is the sum of the slots
+        # before it: adding, replacing and removing an entry and finding its
+        # offset all take O(log n). Removed entries leave empty slots, which
+        # are compacted away once they make up half of the slots.
+        self._items = OrderedDict()
+        self._slots = {}
+        self._lengths = []
+        self._tree = [0]
+        self._total = 0
+        self._data = b""
+        self._names = {}
+        super(GNUStringTable, self).__init__(archive, path, header)
         self.archive.strings = self
 
     @property
     def size(self):
-        if self._size is None:
-            size = 0
-            delimlen = len(self._delimiter)
-            for m in self._order:
-                size += len(self._items[m]) + delimlen
-            return size
-        else:
-            return self._size
+        return self._total
     @size.setter
     def size(self, value):
-        self._size = value
+        # The size is always that of the entries written by collect().
+        pass
 
     def init_from_file(self, path):
         if path == True:
@@ -361,114 +1046,153 @@ class GNUStringTable(ArchiveMember):
         else:
             raise WrongMemberTypeException("Not a GNU string table archive member.")
 
-    def init_from_archive(self):
-        header = self.archive.instream.read(self._header_format.size)
-        if len(header) < self._header_format.size:
-            raise EOFError()
-        nameinfo, date, uid, gid, mode, size, tail = self._header_format.unpack(header)
-        log.debug("Read header values: %s, %s, %s, %s, %s, %s",
-            nameinfo.strip(), date.strip(), uid.strip(), gid.strip(), mode.strip(), size.strip())
-        assert tail == self._header_tail
-
-        self.set_name_from_archive(nameinfo.decode(self.archive.encoding).strip())
+    def init_from_archive(self, header):
+        self.set_name_from_archive(header.name)
         self.sourcedir = None
         try:
-            self.date = int(date.decode(self.archive.encoding).strip())
+            self.date = int(header.date)
         except ValueError:
             self.date = 0
         try:
-            self.uid = int(uid.decode(self.archive.encoding).strip())
+            self.uid = int(header.uid)
         except ValueError:
             self.uid = 0
         try:
-            self.gid = int(gid.decode(self.archive.encoding).strip())
+            self.gid = int(header.gid)
         except ValueError:
             self.gid = 0
         try:
-            self.mode = int(mode.decode(self.archive.encoding).strip(), 8)
+            self.mode = int(header.mode, 8)
         except ValueError:
             self.mode = 0o100644
-        self.size = int(size.decode(self.archive.encoding).strip())
-        self.offset = self.archive.instream.tell()
+        self.offset = header.offset
 
-    def map(self, member, offset):
-        instream = self.archive.instream
-        prevoffset = instream.tell()
-        instream.seek(self.offset + offset)
-        delimlen = len(self._delimiter)
-        filename = instream.read(delimlen)
-        while filename[-delimlen:] != self._delimiter:
-            c = instream.read(1)
-            if len(c) == 0:
+        if header.longname is not None:
+            # The names of the members were resolved from an index.
+            return
+        data = self.archive.reader.read_at(header.offset, header.size)
+        if len(data) < header.size:
+            raise InvalidArchiveException("Truncated string table.")
+        self.parse(data)
+
+    def parse(self, data):
+        """Reads the names from the contents of a string table."""
+        self._data = data
+        self._names = self.split(data)
+
+    @classmethod
+    def split(cls, data):
+        """Splits the contents of a string table into names keyed on their offsets."""
+        names = {}
+        delimlen = len(cls._delimiter)
+        start = 0
+        end = data.find(cls._delimiter)
+        while end >= 0:
+            names[start] = data[start:end].strip(_NAMESTRIP)
+            start = end + delimlen
+            end = data.find(cls._delimiter, start)
+        return names
+
+    @classmethod
+    def lookup(cls, data, names, offset):
+        """Returns the name at offset of a string table split into names."""
+        filename = names.get(offset)
+        if filename is None:
+            # Not the start of an entry; fall back to scanning from the offset.
+            if offset < 0 or offset >= len(data):
+                raise InvalidArchiveException("String table offset {0} out of range.".format(offset))
+            end = data.find(cls._delimiter, offset)
+            if end < 0:
                 raise InvalidArchiveException("Unterminated string table.")
-            filename += c
-        filename = filename[:-2].decode(self.archive.encoding)
-        self[member] = filename.strip(string.whitespace + "\x00")
-        instream.seek(prevoffset)
+            filename = data[offset:end].strip(_NAMESTRIP)
+        return filename
+
+    def map(self, member, offset):
+        member.filename = self.lookup(self._data, self._names, offset)
 
     def __len__(self):
-        return len(self._order)
+        return len(self._items)
 
     def __getitem__(self, member):
         return self._items[member]
 
     def __setitem__(self, member, filename):
         if isstring(filename):
-            filename = filename.encode(self.archive.encoding)
+            filename = tobytes(filename, self.archive.encoding, self.archive.errors)
+        length = len(filename) + len(self._delimiter)
+        previous = self._items.get(member)
         self._items[member] = filename
-        if member not in self._order:
-            self._order.append(member)
+        if previous is None:
+            slot = len(self._lengths)
+            # The new node sums the slots from the one after its lowest set bit.
+            node = slot + 1
+            self._tree.append(length + self._sum(slot) - self._sum(node - (node & -node)))
+            self._lengths.append(length)
+            self._slots[member] = slot
+            self._total += length
+        elif len(previous) != len(filename):
+            slot = self._slots[member]
+            self._add(slot, length - self._lengths[slot])
+            self._lengths[slot] = length
 
     def __delitem__(self, member):
-        if member in self._items:
-            del self._items[member]
-        if member in self._order:
-            self._order.remove(member)
-
-    class Iterator(object):
-        def __init__(self, order, items):
-            self._order = order
-            self._items = items
-            self.index = -1
-
-        def __iter__(self):
-            return self
-
-        def __next__(self):
-            return self.next()
-
-        def next(self):
-            if self.index < len(self._order):
-                m = self._order[self.index]
-                self.index += 1
-                return (m, self._items[m])
-            else:
-                raise StopIteration()
+        if member not in self._items:
+            return
+        del self._items[member]
+        slot = self._slots.pop(member)
+        self._add(slot, -self._lengths[slot])
+        self._lengths[slot] = 0
+        if len(self._slots) * 2 < len(self._lengths):
+            self._reindex()
 
     def __iter__(self):
-        return Iterator(self._order, self._items)
+        return iter(self._items.items())
+
+    def _add(self, slot, delta):
+        tree = self._tree
+        node = slot + 1
+        while node < len(tree):
+            tree[node] += delta
+            node += node & -node
+        self._total += delta
+
+    def _sum(self, slot):
+        # Returns the total length of the slots before slot.
+        tree = self._tree
+        total = 0
+        node = slot
+        while node > 0:
+            total += tree[node]
+            node -= node & -node
+        return total
+
+    def _reindex(self):
+        delimlen = len(self._delimiter)
+        self._lengths = [len(filename) + delimlen for filename in self._items.values()]
+        self._slots = dict((m, slot) for slot, m in enumerate(self._items))
+        tree = [0] + self._lengths
+        for node in range(1, len(tree)):
+            parent = node + (node & -node)
+            if parent < len(tree):
+                tree[parent] += tree[node]
+        self._tree = tree
+        self._total = sum(self._lengths)
 
     def string_offset(self, member):
-        offset = 0
-        delimlen = len(self._delimiter)
-        for m in self._order:
-            if m == member:
-                break
-            offset += len(self._items[m]) + delimlen
-        return offset
+        return self._sum(self._slots[member])
 
-    def collect(self):
-        outfile = self.archive.outstream
-        newoffset = outfile.tell()
-        for m in self._order:
-            outfile.write(self._items[m] + self._delimiter)
-        self.offset = newoffset
+    def payload(self):
+        return b"".join(filename + self._delimiter for filename in self._items.values())
 
+@register_member_type
 class BSDShortMember(ArchiveMember):
+    __slots__ = ()
+
     format = BSD
+    header_key = "<name>"
 
     def set_name_from_file(self, filename):
-        if len(filename.encode(self.archive.encoding)) <= 16 and not _WHITESPACERE.search(filename):
+        if len(tobytes(filename, self.archive.encoding, self.archive.errors)) <= 16 and not _WHITESPACERE.search(filename):
             self.name = filename
             self.filename = filename
         else:
@@ -481,14 +1205,18 @@ class BSDShortMember(ArchiveMember):
         else:
             raise WrongMemberTypeException("Not a short BSD archive member.")
 
+@register_member_type
 class BSDLongMember(ArchiveMember):
+    __slots__ = ("namelength",)
+
     format = BSD
+    header_key = "#1/"
 
     _name_prefix = "#1/"
 
-    def __init__(self, archive, path=None):
+    def __init__(self, archive, path=None, header=None):
         self.namelength = 0
-        super(BSDLongMember, self).__init__(archive, path)
+        super(BSDLongMember, self).__init__(archive, path, header)
 
     @property
     def filesize(self):
@@ -505,39 +1233,45 @@ class BSDLongMember(ArchiveMember):
         pass
 
     def set_name_from_file(self, filename):
-        encoded = filename.encode(self.archive.encoding)
+        encoded = tobytes(filename, self.archive.encoding, self.archive.errors)
         if len(encoded) > 16 or _WHITESPACERE.search(filename):
-            self.namelength = len(encoded)
             self.filename = filename
+            self.namelength = len(self._filename)
         else:
             raise WrongMemberTypeException("Not a long BSD archive member.")
 
+    def init_from_archive(self, header):
+        super(BSDLongMember, self).init_from_archive(header)
+        self.filename = header.longname
+
     def set_name_from_archive(self, nameinfo):
         if nameinfo.startswith(self._name_prefix):
             self.namelength = int(nameinfo[len(self._name_prefix):])
-            self.filename = self.archive.instream.read(self.namelength).decode(self.archive.encoding)
-            if self.filename.startswith(BSDSymbolTable._name_literal):
-                raise WrongMemberTypeException("Not a long BSD archive member.")
         else:
             raise WrongMemberTypeException("Not a long BSD archive member.")
 
-    def write_header(self):
-        super(BSDLongMember, self).write_header()
-        self.archive.outstream.write(self._filename)
+    def header_extra(self):
+        return self._filename.ljust(self.namelength, b"\0")
+
+@register_member_type
+class BSDSymbolTable(_SymbolTable):
+    __slots__ = ("namelength", "sorted", "symdef", "_ranlibs", "_positions")
 
-class BSDSymbolTable(ArchiveMember):
     UNSORTED = 0
     SORTED = 1
 
     format = BSD
-    normal = False
+    header_key = "__.SYMDEF"
 
     _name_literal = "__.SYMDEF"
     _sorted_suffix = "SORTED"
+    _wide_suffix = "_64"
 
-    def __init__(self, archive, path=None):
-        super(BSDSymbolTable, self).__init__(archive, path)
-        self.archive.symbols = self
+    def __init__(self, archive, path=None, header=None):
+        self.symdef = self._name_literal
+        self._ranlibs = None
+        self._positions = None
+        super(BSDSymbolTable, self).__init__(archive, path, header)
 
     @property
     def filesize(self):
@@ -555,19 +1289,25 @@ class BSDSymbolTable(ArchiveMember):
     @property
     def name(self):
         if self.filename is None:
-            return self._name_literal
+            return self.symdef
         else:
             return BSDLongMember._name_prefix + str(self.namelength)
     @name.setter
     def name(self, value):
         pass
 
+    @property
+    def wide(self):
+        """Whether the table is a __.SYMDEF_64 table, with 64-bit entries."""
+        return self.symdef.startswith(self._name_literal + self._wide_suffix)
+
     def init_from_file(self, path):
         if isinstance(path, int):
-            self.sorted = (path == SORTED)
+            self.sorted = (path == self.SORTED)
             if self.sorted:
                 self.filename = self._name_literal + " " + self._sorted_suffix
-                self.namelength = len(self.filename.encode(self.archive.encoding))
+                self.symdef = self.filename
+                self.namelength = len(self._filename)
             else:
                 self.filename = None
                 self.namelength = 0
@@ -580,47 +1320,371 @@ class BSDSymbolTable(ArchiveMember):
         else:
             raise WrongMemberTypeException("Not a BSD symbol table archive member.")
 
+    def init_from_archive(self, header):
+        super(BSDSymbolTable, self).init_from_archive(header)
+        if header.longname is not None:
+            self.filename = header.longname
+            self.symdef = self.filename
+        self.sorted = self.symdef.endswith(self._sorted_suffix)
+
     def set_name_from_archive(self, nameinfo):
-        if nameinfo == self._name_literal:
+        if nameinfo.startswith(self._name_literal):
             self.filename = None
             self.namelength = 0
-            self.sorted = False
+            self.symdef = nameinfo
         elif nameinfo.startswith(BSDLongMember._name_prefix):
             self.namelength = int(nameinfo[len(BSDLongMember._name_prefix):])
-            self.filename = self.archive.instream.read(self.namelength).decode(self.archive.encoding)
-            if not self.filename.startswith(self._name_literal):
-                raise WrongMemberTypeException("Not a BSD symbol table archive member.")
-            self.sorted = self.filename.endswith(self._sorted_suffix)
         else:
             raise WrongMemberTypeException("Not a BSD symbol table archive member.")
 
-    def write_header(self):
-        super(BSDSymbolTable, self).write_header()
-        if self.filename is not None:
-            self.archive.outstream.write(self.filename.encode(self.archive.encoding))
+    @classmethod
+    def parse(cls, data, wide=False):
+        """Returns the name offsets and member offsets, as arrays, and the string table of a ranlib payload.
+
+        The payload is the size in bytes of an array of ranlib entries, the
+        entries (each the offset of a name in the string table and the
+        offset of a member header), the size of the string table and the
+        string table. Fields are 32 bits, or 64 bits when wide, in the byte
+        order of the machine the library was built for, which is detected.
+        """
+        word = 8 if wide else 4
+        if len(data) < 2 * word:
+            raise InvalidArchiveException("Truncated ranlib symbol table.")
+        for byteorder, code in (("little", "<"), ("big", ">")):
+            sizeformat = struct.Struct(code + ("Q" if wide else "I"))
+            size, = sizeformat.unpack_from(data, 0)
+            if size % (2 * word) or 2 * word + size > len(data):
+                continue
+            strsize, = sizeformat.unpack_from(data, word + size)
+            if 2 * word + size + strsize > len(data):
+                continue
+            entries = _unpack_uints(data[word:word + size], word, byteorder)
+            strings = bytes(data[2 * word + size:2 * word + size + strsize])
+            return entries[0::2], entries[1::2], strings
+        raise InvalidArchiveException("Invalid ranlib symbol table.")
+
+    def _load_ranlibs(self):
+        if self._ranlibs is None:
+            if self._payload is not None:
+                self._ranlibs = self.parse(self._payload, self.wide)
+            elif self._entries is not None:
+                # Entries from an index; rebuild the string table they point into.
+                offsets, names = self._entries
+                strxs = array(_INT64)
+                strings = bytearray()
+                for name in names:
+                    strxs.append(len(strings))
+                    strings += name + b"\0"
+                self._ranlibs = (strxs, offsets, bytes(strings))
+            elif self.offset is None or self.sourcedir is not None:
+                self._ranlibs = (array("I"), array("I"), b"")
+            else:
+                self._ranlibs = self.parse(self.archive.reader.read_at(self.offset, self.filesize), self.wide)
+        return self._ranlibs
 
+    @staticmethod
+    def _symbol_name(strings, strx):
+        end = strings.find(b"\0", strx)
+        return strings[strx:end if end >= 0 else len(strings)]
+
+    def entries(self):
+        strxs, offsets, strings = self._load_ranlibs()
+        return offsets, [self._symbol_name(strings, strx) for strx in strxs]
+
+    def find(self, symbol, default=None):
+        # Sorted tables are searched by bisection over the decoded entries,
+        # without building the symbol map.
+        if not self.sorted or self._symbols is not None:
+            return super(BSDSymbolTable, self).find(symbol, default)
+        strxs, offsets, strings = self._load_ranlibs()
+        key = tobytes(symbol, self.archive.encoding, self.archive.errors)
+        lo, hi = 0, len(strxs)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._symbol_name(strings, strxs[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(strxs) or self._symbol_name(strings, strxs[lo]) != key:
+            return default
+        if self._positions is None:
+            self._positions = self.archive._offset_index()
+        position = self._positions.get(offsets[lo])
+        if position is None:
+            return default
+        return self.archive.members[position]
+
+    def build(self, entries):
+        """Replaces the table with entries, a list of (symbol name as bytes, member header offset) pairs.
+
+        The table is written sorted by name, little-endian, with 32-bit or,
+        for a wide table, 64-bit fields.
+        """
+        code = "<Q" if self.wide else "<I"
+        word = struct.calcsize(code)
+        strxs = {}
+        strings = bytearray()
+        ranlibs = []
+        for name, offset in sorted(entries, key=lambda entry: entry[0]):
+            if name not in strxs:
+                strxs[name] = len(strings)
+                strings += name + b"\0"
+            ranlibs.append(strxs[name])
+            ranlibs.append(offset)
+        strings += b"\0" * (-len(strings) % word)
+        self._payload = b"".join((struct.pack(code, len(ranlibs) * word),
+                                  struct.pack("<%d%s" % (len(ranlibs), code[1]), *ranlibs),
+                                  struct.pack(code, len(strings)), bytes(strings)))
+        if not self.sorted:
+            symdef = self.symdef + " " + self._sorted_suffix
+            if self.filename is None and len(symdef) <= 16:
+                self.symdef = symdef
+            else:
+                self.filename = self.symdef = symdef
+                self.namelength = len(self._filename)
+            self.sorted = True
+        self.filesize = len(self._payload)
+        self._ranlibs = None
+        self._symbols = None
+        self._entries = None
+        self._positions = None
+
+    def header_extra(self):
+        if self.filename is None:
+            return b""
+        return self._filename.ljust(self.namelength, b"\0")
+
+@register_member_type
 class DEBShortMember(BSDShortMember):
+    __slots__ = ()
+
     format = DEB
+    header_key = None
 
-    def __init__(self, member, path=None):
-        super(DEBShortMember, self).__init__(member, path)
+    def __init__(self, member, path=None, header=None):
+        super(DEBShortMember, self).__init__(member, path, header)
         self.uid = 0
         self.gid = 0
 
+class MemberTable(object):
+    """Columnar storage for the members of a large archive.
+
+    The numeric fields of each loaded member are kept in arrays and its
+    names in a single bytes blob. ArchiveMember objects are created from
+    them on first access and kept from then on. Members added to the
+    archive are kept as objects.
+
+    The table supports the list operations the archive uses: len(),
+    indexing and slicing, iteration, append(), insert(), pop(), sort(),
+    index() and del. Slices return member objects. sort() creates every
+    member.
+    """
+
+    # How the header name of a member relates to its filename.
+    _SAME = 0
+    _TERMINATED = 1
+    _STORED = 2
+
+    _columns = (("_offsets", _INT64), ("_sizes", _INT64), ("_dates", _INT64), ("_uids", "i"), ("_gids", "i"),
+                ("_modes", "i"), ("_kinds", "b"))
+
+    def __init__(self, archive):
+        self.archive = archive
+        for column, typecode in self._columns:
+            setattr(self, column, array(typecode))
+        # Names of member i are _names[_namestarts[i]:_namestarts[i + 1]]:
+        # the filename, followed for _STORED members by a NUL and the header name.
+        self._names = bytearray()
+        self._namestarts = array(_INT64, [0])
+        self._members = []
+        # The number of times rows were removed or moved.
+        self.moves = 0
+
+    def __len__(self):
+        return len(self._members)
+
+    def _append_columns(self, names, values):
+        self._names += names
+        self._namestarts.append(len(self._names))
+        for (column, typecode), value in zip(self._columns, values):
+            getattr(self, column).append(value)
+
+    def append(self, member):
+        self._append_columns(tobytes(member.filename, self.archive.encoding, self.archive.errors), (0, 0, 0, 0, 0, 0, self._SAME))
+        self._members.append(member)
+
+    def append_header(self, header, member):
+        """Stores a loaded member as its header and filename, without keeping the object."""
+        filename = member.filename
+        names = member._filename if member._filename is not None else b""
+        if header.name == filename:
+            kind = self._SAME
+        elif header.name == filename + GNUShortMember._name_terminal:
+            kind = self._TERMINATED
+        else:
+            kind = self._STORED
+            names += b"\0" + tobytes(header.name, self.archive.encoding, self.archive.errors)
+        self._append_columns(names, (header.offset, header.size, member.date, member.uid, member.gid,
+                                     member.mode, kind))
+        self._members.append(None)
+
+    def _names_at(self, index):
+        names = bytes(self._names[self._namestarts[index]:self._namestarts[index + 1]])
+        if self._kinds[index] == self._STORED:
+            filename, name = names.split(b"\0", 1)
+            return tostr(filename, self.archive.encoding, self.archive.errors), tostr(name, self.archive.encoding, self.archive.errors)
+        filename = tostr(names, self.archive.encoding, self.archive.errors)
+        if self._kinds[index] == self._TERMINATED:
+            return filename, filename + GNUShortMember._name_terminal
+        return filename, filename
+
+    def header_offset(self, index):
+        member = self._members[index]
+        if member is not None:
+            return member.header_offset
+        if index < 0:
+            index += len(self._members)
+        namelength = 0
+        if self._kinds[index] == self._STORED:
+            name = self._names_at(index)[1]
+            if name.startswith(BSDLongMember._name_prefix):
+                namelength = int(name[len(BSDLongMember._name_prefix):])
+        return self._offsets[index] - ArchiveMember._header_packer.size - namelength
+
+    def stored_name(self, index):
+        """Returns the filename, as bytes, stored for row index when it was added."""
+        names = self._names[self._namestarts[index]:self._namestarts[index + 1]]
+        if self._kinds[index] == self._STORED:
+            names = names[:names.index(b"\0")]
+        return bytes(names)
+
+    def filename(self, index):
+        member = self._members[index]
+        if member is not None:
+            return member.filename
+        if index < 0:
+            index += len(self._members)
+        return self._names_at(index)[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._members)))]
+        member = self._members[index]
+        if member is None:
+            if index < 0:
+                index += len(self._members)
+            filename, name = self._names_at(index)
+            longname = filename if self._kinds[index] == self._STORED else None
+            header = _MemberHeader(name, longname, str(self._dates[index]).encode("ascii"),
+                                   str(self._uids[index]).encode("ascii"), str(self._gids[index]).encode("ascii"),
+                                   "{0:o}".format(self._modes[index]).encode("ascii"), self._sizes[index],
+                                   self._offsets[index], self._offsets[index] + self._sizes[index])
+            member = self.archive.member_type(header)(self.archive, header=header)
+            self._members[index] = member
+        return member
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            for i in sorted(range(*index.indices(len(self._members))), reverse=True):
+                del self[i]
+            return
+        if index < 0:
+            index += len(self._members)
+        for column, typecode in self._columns:
+            del getattr(self, column)[index]
+        start, end = self._namestarts[index], self._namestarts[index + 1]
+        del self._names[start:end]
+        del self._namestarts[index + 1]
+        for i in range(index + 1, len(self._namestarts)):
+            self._namestarts[i] -= end - start
+        del self._members[index]
+        self.moves += 1
+
+    def insert(self, index, member):
+        count = len(self._members)
+        if index < 0:
+            index = max(index + count, 0)
+        index = min(index, count)
+        names = tobytes(member.filename, self.archive.encoding, self.archive.errors)
+        start = self._namestarts[index]
+        self._names[start:start] = names
+        for i in range(index + 1, count + 1):
+            self._namestarts[i] += len(names)
+        self._namestarts.insert(index + 1, start + len(names))
+        for (column, typecode), value in zip(self._columns, (0, 0, 0, 0, 0, 0, self._SAME)):
+            getattr(self, column).insert(index, value)
+        self._members.insert(index, member)
+        self.moves += 1
+
+    def pop(self, index=-1):
+        member = self[index]
+        del self[index]
+        return member
+
+    def sort(self, key=None, reverse=False):
+        members = sorted(self, key=key, reverse=reverse)
+        moves = self.moves + 1
+        self.__init__(self.archive)
+        for member in members:
+            self.append(member)
+        self.moves = moves
+
+    def __iter__(self):
+        for index in range(len(self._members)):
+            yield self[index]
+
+    def index(self, member):
+        for index, m in enumerate(self._members):
+            if m is member:
+                return index
+        raise ValueError("{0!r} is not in the table".format(member))
+
 class Archive(object):
     _magic = b"!<arch>\n"
     _body_pad = b"\n"
+    _index_suffix = ".arindex"
+    _index_version = 4
+    # Rows of a MemberTable indexed one by one before they are all sorted again.
+    _index_overflow = 64
 
-    def __init__(self, format=GNU, encoding='utf-8'):
+    def __init__(self, format=GNU, encoding='utf-8', blocksize=_BLOCKSIZE, errors='strict'):
         self.reset()
         self.format = format
         self.encoding = encoding
+        self.errors = errors
+        self.buffers = _BufferPool(blocksize)
 
     def __repr__(self):
-        return "<Archive(format={0}, member_count={1})>".format(_FORMATNAMES[self._format], len(self.members))
+        return "<Archive(format={0}, member_count={1})>".format(_FORMATNAMES[self._format], len(self._members))
+
+    @property
+    def members(self):
+        while self._load_next():
+            pass
+        return self._members
+    @members.setter
+    def members(self, value):
+        self._members = value
+        self._pending = None
+        self._clear_index()
+
+    @property
+    def symbols(self):
+        # A symbol table is the first member, so a lazily loaded archive is
+        # read only until its first member is found.
+        while self._symbols is None and not len(self._members) and self._load_next():
+            pass
+        return self._symbols
+    @symbols.setter
+    def symbols(self, value):
+        self._symbols = value
 
     @property
     def strings(self):
+        # The string table precedes every normal member, so it cannot be
+        # found once one has been read.
+        while self._strings is None and not len(self._members) and self._load_next():
+            pass
         if self._strings is None and self.format == GNU:
             GNUStringTable(self, True)
         return self._strings
@@ -630,6 +1694,8 @@ class Archive(object):
 
     @property
     def format(self):
+        while self._format is None and self._load_next():
+            pass
         if self._format is None:
             raise InvalidArchiveException("No archive format specified or detected.")
         else:
@@ -648,59 +1714,360 @@ class Archive(object):
         self.members = []
         self.instream = None
         self.outstream = None
-
-    def load(self, filething):
+        self.mapping = None
+        self.reader = None
+        self._source = None
+        self._owned = False
+        self._loadlock = threading.RLock()
+        self._headers = None
+
+    def load(self, filething, use_mmap=False, lazy=False, reader=make_reader, index_cache=None, compact=False):
+        """Loads an archive from a path or a file object.
+
+        With use_mmap, the file is memory-mapped and the mapping replaces the
+        file as instream. Headers are then parsed directly from the mapping
+        and ArchiveMember.view() returns payloads without copying them.
+
+        With lazy, only the magic is validated. Members are then read as
+        iteration and lookups reach them, and the whole archive is read only
+        when members, len() or the format require it.
+
+        Member data is read through a Reader created by calling reader with
+        instream; the default picks one suited to the file object.
+
+        With index_cache, an archive loaded from a path keeps the headers of
+        its members and its decoded symbol table in an index file: next to
+        the archive if index_cache is True, otherwise in the directory
+        index_cache. The index is keyed on the device, inode, size and
+        modification time of the archive, so a later load reuses it after a
+        single stat and rebuilds it once the archive changes. It is also
+        rebuilt for a load with another encoding or errors.
+
+        With compact, members are kept in a MemberTable rather than as
+        objects, which takes several times less memory for archives with
+        very many members. The GNU string table then lists the long names
+        of only the members created so far; save() creates every member
+        first, so that the table it writes is complete.
+        """
         self.reset()
+        if compact:
+            self.members = MemberTable(self)
 
         log.debug("Loading %r", filething)
+        indexpath = None
         if isstring(filething):
             self.instream = open(filething, "rb")
+            self._owned = True
+            if index_cache:
+                indexpath = self._index_path(filething, index_cache)
+                indexkey = _stat_key(os.fstat(self.instream.fileno()))
         else:
             self.instream = filething
-        assert hasattr(self.instream, "read") and hasattr(self.instream, "tell") and hasattr(self.instream, "seek")
-
-        magic = self.instream.read(len(self._magic))
+        assert hasattr(self.instream, "read")
+        fileno = _fileno(self.instream)
+        if fileno is not None:
+            st = os.fstat(fileno)
+            self._source = (st.st_dev, st.st_ino)
+
+        if use_mmap:
+            self.mapping = self.map_file(self.instream)
+            if isstring(filething):
+                self.instream.close()
+            self.instream = self.mapping
+
+        self.reader = reader(self.instream)
+        if indexpath is not None and self._load_index(indexpath, indexkey):
+            log.debug("Loaded %r from index %s", self, indexpath)
+            return
+
+        start = _tell(self.instream)
+        magic = self.reader.read_at(start, len(self._magic))
         if magic != self._magic:
             raise InvalidArchiveException("{0}: invalid magic: '{1}' ({2}) (expected '{3}' ({4}))".format(
                 self.instream, magic, len(magic), self._magic, len(self._magic)))
 
-        member = self.read_member()
-        while member is not None:
-            if member.normal:
-                self.members.append(member)
-            if self.instream.tell() % 2 == 1:
-                padding = self.instream.read(len(self._body_pad))
-                if padding != self._body_pad:
-                    raise InvalidArchiveException("Source of invalid archive: {0}".format(self.instream))
-            member = self.read_member()
-
-        if self.members and self.members[0].name == "debian-binary":
-            self.format = DEB
-        log.debug("Loaded %r", self)
-
-    def read_member(self):
-        member = None
-        for cls in ArchiveMember.derived():
-            oldoffset = self.instream.tell()
-            log.debug("Starting at offset %u", oldoffset)
+        self._pending = start + len(self._magic)
+        if not lazy:
+            if indexpath is not None:
+                self._headers = []
+            while self._load_next():
+                pass
+            if indexpath is not None:
+                self._save_index(indexpath, indexkey)
+            log.debug("Loaded %r", self)
+
+    @staticmethod
+    def _index_path(path, index_cache):
+        if index_cache is True:
+            return path + Archive._index_suffix
+        digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(index_cache, digest + Archive._index_suffix)
+
+    def _load_index(self, indexpath, indexkey):
+        try:
+            with open(indexpath, "r") as f:
+                index = json.load(f)
+            if index["version"] != self._index_version or index["key"] != indexkey or \
+                    index["encoding"] != self.encoding or index["errors"] != self.errors:
+                log.debug("Index %s is stale", indexpath)
+                return False
+            headers = [_MemberHeader(name, longname, date.encode("latin-1"), uid.encode("latin-1"),
+                                     gid.encode("latin-1"), mode.encode("latin-1"), size, offset, end)
+                       for name, longname, date, uid, gid, mode, size, offset, end in index["headers"]]
+            symbols = index["symbols"]
+            if symbols is not None:
+                symbols = ([offset for offset, name in symbols], [name.encode("latin-1") for offset, name in symbols])
+            members = [self.create_member(header) for header in headers]
+        except (IOError, OSError, ValueError, KeyError, TypeError, InvalidArchiveException,
+                WrongMemberTypeException) as e:
+            log.debug("Cannot use index %s: %s", indexpath, e)
+            # Forget what the members created so far registered.
+            self._format = None
+            self._symbols = None
+            self._strings = None
+            self.members = MemberTable(self) if isinstance(self._members, MemberTable) else []
+            return False
+
+        for member, header in zip(members, headers):
+            self._add_loaded(member, header)
+        if self._symbols is not None and symbols is not None:
+            self._symbols._entries = symbols
+        return True
+
+    def _save_index(self, indexpath, indexkey):
+        index = {
+            "version": self._index_version,
+            "key": indexkey,
+            "encoding": self.encoding,
+            "errors": self.errors,
+            "headers": [(h.name, h.longname, h.date.decode("latin-1"), h.uid.decode("latin-1"),
+                         h.gid.decode("latin-1"), h.mode.decode("latin-1"), h.size, h.offset, h.end)
+                        for h in self._headers],
+            "symbols": None,
+        }
+        if self._symbols is not None:
             try:
-                member = cls(self)
-                self.format = member.format
-                self.instream.seek(member.offset + member.filesize)
-                break
-            except WrongMemberTypeException as e:
-                log.debug("Wrong type for member: %s", e)
-                self.instream.seek(oldoffset)
-            except EOFError:
-                log.debug("End of file")
+                offsets, names = self._symbols.entries()
+            except InvalidArchiveException as e:
+                log.debug("Not indexing symbols: %s", e)
+            else:
+                index["symbols"] = [(offset, name.decode("latin-1")) for offset, name in zip(offsets, names)]
+        self._headers = None
+        temppath = "{0}.{1}.tmp".format(indexpath, os.getpid())
+        try:
+            with open(temppath, "w") as f:
+                json.dump(index, f)
+            os.rename(temppath, indexpath)
+        except (IOError, OSError) as e:
+            log.debug("Cannot write index %s: %s", indexpath, e)
+            try:
+                os.remove(temppath)
+            except OSError:
+                pass
+
+    def stream(self, filething):
+        """Reads an archive from a non-seekable input in a single pass.
+
+        Like tarfile's "r|" mode: returns an iterator over the members that
+        never seeks. Read each member's payload with open(), view() or
+        extract() before advancing to the next member; payloads left behind
+        are skipped and cannot be read afterwards.
+        """
+        self.load(filething, lazy=True, reader=ForwardReader)
+        return iter(self)
+
+    def _load_next(self):
+        """Reads the next member of a partially loaded archive.
+
+        Returns False once every member has been read.
+        """
+        with self._loadlock:
+            loaded = self._read_next()
+            if loaded is None:
+                return False
+            member, header = loaded
+            if self._headers is not None:
+                if isinstance(member, GNULongMember):
+                    self._headers.append(header._replace(longname=member.filename))
+                elif isinstance(member, GNUStringTable):
+                    self._headers.append(header._replace(longname=""))
+                else:
+                    self._headers.append(header)
+            self._add_loaded(member, header)
+            return True
+
+    def _read_next(self):
+        """Reads the member at the pending position and moves the position past it.
+
+        Returns the member and its header, or None at the end of the archive.
+        """
+        with self._loadlock:
+            # Clearing the position while reading keeps a member that asks for
+            # the archive format from recursing into the archive.
+            pending, self._pending = self._pending, None
+            if pending is None:
                 return None
-        if member is None:
+            start = None
+            try:
+                start = self._skip_padding(pending)
+                header = self.read_header(start)
+                if header is None:
+                    log.debug("End of file")
+                    return None
+                member = self.create_member(header)
+            except:
+                # Keep the position so that every later access raises the
+                # error again instead of treating the archive as complete.
+                self._pending = pending if start is None else start
+                raise
+            # The padding after an odd-sized payload is checked when the next
+            # member is read, so a forward-only reader can still read this one.
+            self._pending = header.end
+            return member, header
+
+    def _next_header(self):
+        """Reads the header at the pending position and moves the position past its member."""
+        with self._loadlock:
+            if self._pending is None:
+                return None
+            start = self._pending = self._skip_padding(self._pending)
+            header = self.read_header(start)
+            self._pending = header.end if header is not None else None
+            return header
+
+    def _skip_padding(self, offset):
+        """Returns the offset of the header following a member ending at offset."""
+        if offset % 2 == 1:
+            padding = self.reader.read_at(offset, len(self._body_pad))
+            if padding != self._body_pad:
+                raise InvalidArchiveException("Source of invalid archive: {0}".format(self.instream))
+            offset += len(padding)
+        return offset
+
+    def _add_loaded(self, member, header):
+        if member.normal:
+            if isinstance(self._members, MemberTable):
+                self._members.append_header(header, member)
+                if self._strings is not None:
+                    del self._strings[member]
+            else:
+                self._members.append(member)
+            if len(self._members) == 1 and header.name == "debian-binary":
+                self.format = DEB
+
+    @staticmethod
+    def map_file(fileobj):
+        """Returns a read-only memory mapping of a file object."""
+        fileno = fileobj.fileno()
+        if os.fstat(fileno).st_size == 0:
+            raise InvalidArchiveException("{0}: empty file".format(fileobj))
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+    def read_header(self, start):
+        """Reads the member header at offset start of the archive.
+
+        Returns a _MemberHeader, or None at the end of the archive. The BSD
+        long name that follows a "#1/" header is read as part of the header.
+        """
+        header_format = ArchiveMember._header_format
+        if self.mapping is not None:
+            if start + header_format.size > len(self.mapping):
+                return None
+            fields = header_format.unpack_from(self.mapping, start)
+        else:
+            raw = self.reader.read_at(start, header_format.size)
+            if len(raw) < header_format.size:
+                return None
+            fields = header_format.unpack(raw)
+        nameinfo, date, uid, gid, mode, size, tail = fields
+        log.debug("Read header values: %s, %s, %s, %s, %s, %s",
+            nameinfo.strip(), date.strip(), uid.strip(), gid.strip(), mode.strip(), size.strip())
+        if tail != ArchiveMember._header_tail:
+            raise InvalidArchiveException("Invalid member header at offset {0}".format(start))
+
+        name = nameinfo.decode(self.encoding, self.errors).strip()
+        try:
+            size = int(size)
+        except ValueError:
+            raise InvalidArchiveException("Invalid size for member '{0}' at offset {1}".format(name, start))
+
+        offset = start + header_format.size
+        longname = None
+        if name.startswith(BSDLongMember._name_prefix):
+            try:
+                namelength = int(name[len(BSDLongMember._name_prefix):])
+            except ValueError:
+                raise InvalidArchiveException("Invalid BSD name length for member '{0}'".format(name))
+            longname = self.reader.read_at(offset, namelength)
+            if len(longname) < namelength:
+                raise InvalidArchiveException("Truncated BSD name for member '{0}'".format(name))
+            longname = longname.decode(self.encoding, self.errors)
+            offset += namelength
+
+        return _MemberHeader(name, longname, date.strip(), uid.strip(), gid.strip(), mode.strip(),
+                             size, offset, start + header_format.size + size)
+
+    @staticmethod
+    def member_type(header):
+        """Returns the registered member class for a header read from an archive."""
+        name = header.name
+        if name in _MEMBER_TYPES:
+            key = name
+        elif name.startswith(BSDLongMember._name_prefix):
+            if header.longname.startswith(BSDSymbolTable._name_literal):
+                key = BSDSymbolTable.header_key
+            else:
+                key = BSDLongMember.header_key
+        elif name.startswith(BSDSymbolTable._name_literal):
+            key = BSDSymbolTable.header_key
+        elif GNULongMember._name_re.match(name):
+            key = GNULongMember.header_key
+        elif name.endswith(GNUShortMember._name_terminal):
+            key = GNUShortMember.header_key
+        else:
+            key = BSDShortMember.header_key
+
+        try:
+            return _MEMBER_TYPES[key]
+        except KeyError:
             raise WrongMemberTypeException("Unknown member type")
 
+    def read_member(self, start=None):
+        """Reads the member whose header is at offset start, or returns None at the end of the archive.
+
+        Without start, reads the next member a lazy load has not reached yet
+        and moves past it, so that repeated calls return each member in turn.
+        Members read this way are not added to the members.
+        """
+        if start is None:
+            loaded = self._read_next()
+            return loaded[0] if loaded is not None else None
+        header = self.read_header(start)
+        if header is None:
+            return None
+        return self.create_member(header)
+
+    def create_member(self, header):
+        log.debug("Creating member at offset %u", header.offset)
+        member = self.member_type(header)(self, header=header)
+        if self._format != DEB:
+            self.format = member.format
+
         log.debug("Read member %r", member)
         return member
 
-    def save(self, filething):
+    def save(self, filething, workers=1, build_symbol_index=False):
+        """Writes the archive to filething, a path or a file object.
+
+        With workers greater than 1 and an output file with a descriptor,
+        the layout of the whole archive is computed first, the file is
+        preallocated, and a pool of that many threads writes every member
+        into its place with positional writes.
+
+        With build_symbol_index the symbol table is rebuilt, or created, from
+        the global symbols defined by the ELF and Mach-O object members (see
+        build_symbol_index()).
+        """
         log.debug("Saving %r", filething)
         if isstring(filething):
             self.outstream = open(filething, "wb")
@@ -708,10 +2075,73 @@ class Archive(object):
             self.outstream = filething
         assert hasattr(self.outstream, "write") and hasattr(self.outstream, "tell") and hasattr(self.outstream, "seek")
 
-        self.outstream.write(self._magic)
-        self.write_member(self.symbols)
-        if self.format == GNU:
-            self.write_member(self.strings)
+        if build_symbol_index:
+            self.build_symbol_index()
+        members = self._output_members()
+        headers = self.pack_headers(members)
+
+        outstream = self.outstream
+        if workers > 1 and hasattr(os, "pwrite") and _fileno(outstream) is not None:
+            self._save_parallel(members, headers, workers)
+            log.debug("Saved %r", self)
+            return
+        if hasattr(os, "writev") and _fileno(outstream) is not None:
+            self.outstream = _GatherWriter(outstream)
+        try:
+            self.outstream.write(self._magic)
+            for m, header in zip(members, headers):
+                self.write_member(m, header)
+                self.write_padding()
+            self.outstream.flush()
+        finally:
+            self.outstream = outstream
+
+        log.debug("Saved %r", self)
+
+    def build_symbol_index(self):
+        """Rebuilds the symbol table from the global symbols the object members define.
+
+        A table is added if the archive has none. The size of the table does
+        not depend on the offsets it lists, so it is built once to fix the
+        layout of the archive and again with the offsets at which save()
+        will write each member header. A GNU table is replaced by a /SYM64/
+        table when a member header would start past 4 GiB. Debian packages
+        have no symbol table.
+        """
+        if self.format == DEB:
+            return
+        if not self.symbols:
+            if self.format == BSD:
+                BSDSymbolTable(self, BSDSymbolTable.SORTED)
+            else:
+                GNUSymbolTable(self, True)
+        table = self.symbols
+
+        defined = [object_symbols(m.view())[0] for m in self.members]
+        table.build([(name, 0) for names in defined for name in names])
+
+        members = self._output_members()
+        slots, end = self.layout(members)
+        if isinstance(table, GNUSymbolTable) and not isinstance(table, GNUSymbolTable64) and \
+                slots[-1][0] >= _SYM64_OFFSET:
+            # Offsets past 4 GiB need the 64-bit table, whose larger entries move every member.
+            log.debug("Switching to a /SYM64/ symbol table")
+            table = GNUSymbolTable64(self, True)
+            table.build([(name, 0) for names in defined for name in names])
+            members = self._output_members()
+            slots, end = self.layout(members)
+        headers = [pos for pos, payload, stop in slots[len(members) - len(defined):]]
+        table.build([(name, offset) for names, offset in zip(defined, headers) for name in names])
+        # Those offsets are where the members will be written, not where they
+        # are read from, so the symbols are mapped to the members here.
+        symbols = {}
+        for names, m in zip(defined, self.members):
+            for name in names:
+                symbols.setdefault(tostr(name, self.encoding, self.errors), m)
+        table._symbols = symbols
+
+    def _output_members(self):
+        """Returns every member to be written, tables first, in order."""
         if self.format == DEB:
             debian_format = [None, None, None]
             extra = []
@@ -731,26 +2161,226 @@ class Archive(object):
             debian_format.extend(extra)
             self.members = debian_format
 
-        for m in self.members:
-            self.write_member(m)
-            if self.outstream.tell() % 2 == 1:
-                self.outstream.write(self._body_pad)
+        # Members are created first: doing so reads a lazily loaded archive
+        # to the end and registers the long names of compact members.
+        members = list(self.members)
+        tables = [self.symbols]
+        if self.format == GNU:
+            tables.append(self.strings)
+        return [m for m in tables if m] + members
+
+    def layout(self, members, start=0):
+        """Returns where members would be written in an archive starting at start.
+
+        The result is a list of (header offset, payload offset, payload end)
+        tuples, one per member, and the end of the archive. A payload ending
+        at an odd offset is followed by one byte of padding.
+        """
+        slots = []
+        pos = start + len(self._magic)
+        for m in members:
+            payload = pos + ArchiveMember._header_packer.size + m.size - m.filesize
+            end = payload + m.filesize
+            slots.append((pos, payload, end))
+            pos = end + (end & 1)
+        return slots, pos
+
+    def _save_parallel(self, members, headers, workers):
+        outstream = self.outstream
+        outstream.flush()
+        fd = outstream.fileno()
+        start = outstream.tell()
+        slots, end = self.layout(members, start)
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, start, end - start)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                log.debug("Preallocation unavailable: %s", e)
+        os.ftruncate(fd, end)
+
+        _pwrite_all(fd, self._magic, start)
+        pool = ThreadPool(min(workers, len(members)) or 1)
+        try:
+            pool.map(lambda item: self._write_slot(fd, *item), list(zip(members, headers, slots)), 1)
+        finally:
+            pool.close()
+            pool.join()
+        outstream.seek(end)
+
+    def _write_slot(self, fd, member, header, slot):
+        pos, payload, stop = slot
+        _pwrite_all(fd, header.tobytes() + member.header_extra(), pos)
+        member.collect_at(fd, payload)
+        if stop & 1:
+            _pwrite_all(fd, self._body_pad, stop)
+
+    def update(self, path):
+        """Writes the archive to path, reusing what is unchanged from the loaded archive.
+
+        Runs of members that are unchanged and still adjacent are copied from
+        the loaded archive with one ranged kernel copy per run. The archive is
+        written to a temporary file in the directory of path, synced, and
+        renamed over path, so path holds either the old or the new archive.
+
+        When path is the file the archive was loaded from and only members
+        at its end were added or removed, path is instead appended to and
+        truncated in place. Afterwards the archive reads from path.
+        """
+        log.debug("Updating %r", path)
+        members = self._output_members()
+        headers = self.pack_headers(members)
+        slots, end = self.layout(members)
+        sources = [self._unchanged_source(m, header, slot) for m, header, slot in zip(members, headers, slots)]
+
+        # Group unchanged members whose original bytes are contiguous into runs.
+        runs = []
+        pending = []
+        for i, source in enumerate(sources):
+            if source is None:
+                pending.append(i)
+                continue
+            first, last, start = runs[-1] if runs else (None, None, None)
+            if last == i and start + slots[i][0] - slots[first][0] == source:
+                runs[-1] = (first, i + 1, start)
+            else:
+                runs.append((i, i + 1, source))
 
-        log.debug("Saved %r", self)
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        # In place, only members added from files may follow the unchanged
+        # prefix, as anything read from the archive could be overwritten.
+        # A mapped file is never shrunk, as views of its tail would fault.
+        inplace = (st is not None and self._source == (st.st_dev, st.st_ino) and len(runs) == 1 and
+                   runs[0][0] == 0 and runs[0][2] == slots[0][0] and
+                   all(members[i].sourcedir is not None for i in pending) and
+                   (self.mapping is None or end >= st.st_size))
+        if inplace:
+            log.debug("Updating %r in place after %d unchanged members", path, runs[0][1])
+            with open(path, "r+b") as f:
+                fd = f.fileno()
+                stop = slots[runs[0][1] - 1][2]
+                if stop & 1:
+                    _pwrite_all(fd, self._body_pad, stop)
+                for i in pending:
+                    self._write_slot(fd, members[i], headers[i], slots[i])
+                os.ftruncate(fd, end)
+                os.fsync(fd)
+        else:
+            directory = os.path.dirname(os.path.abspath(path))
+            fd, tmppath = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", dir=directory)
+            try:
+                if hasattr(os, "fchmod"):
+                    os.fchmod(fd, st.st_mode & 0o7777 if st is not None else 0o666 & ~_umask())
+                _pwrite_all(fd, self._magic, 0)
+                for first, last, source in runs:
+                    pos, stop = slots[first][0], slots[last - 1][2]
+                    _copy_range_at(self.reader, source, fd, pos, stop - pos, self.buffers)
+                    if stop & 1:
+                        _pwrite_all(fd, self._body_pad, stop)
+                for i in pending:
+                    self._write_slot(fd, members[i], headers[i], slots[i])
+                os.ftruncate(fd, end)
+                os.fsync(fd)
+            except:
+                os.close(fd)
+                os.unlink(tmppath)
+                raise
+            os.close(fd)
+            os.rename(tmppath, path)
+            try:
+                dirfd = os.open(directory, os.O_RDONLY)
+            except OSError:
+                pass
+            else:
+                try:
+                    os.fsync(dirfd)
+                except OSError:
+                    pass
+                os.close(dirfd)
+
+        for m, (pos, payload, stop) in zip(members, slots):
+            m.offset = payload
+            m.sourcedir = None
+        mapped = self.mapping is not None
+        self._close_source()
+        self.instream = open(path, "rb")
+        self._owned = True
+        st = os.fstat(self.instream.fileno())
+        self._source = (st.st_dev, st.st_ino)
+        if mapped:
+            self.mapping = self.map_file(self.instream)
+            self.instream.close()
+            self.instream = self.mapping
+        self.reader = make_reader(self.instream)
+        log.debug("Updated %r", self)
+
+    def _close_source(self):
+        """Closes the mapping, or the file load() opened; file objects passed to load() are left open."""
+        if self.mapping is not None:
+            try:
+                self.mapping.close()
+            except BufferError:
+                # Member views still use the mapping; it is freed with them.
+                log.debug("Mapping of %r still in use", self)
+            self.mapping = None
+        elif self._owned:
+            self.instream.close()
+        self._owned = False
+
+    def _unchanged_source(self, member, header, slot):
+        """Returns where member starts in the loaded archive if its bytes there can be reused, else None."""
+        if member.sourcedir is not None or member.offset is None or \
+                self.reader is None or isinstance(self.reader, ForwardReader):
+            return None
+        extra = member.header_extra()
+        start = member.offset - len(header) - len(extra)
+        if start < 0 or (start - slot[0]) & 1:
+            return None
+        if self.reader.read_at(start, len(header) + len(extra)) != header.tobytes() + extra:
+            return None
+        payload = member.payload()
+        if payload is not None and self.reader.read_at(member.offset, member.filesize) != payload:
+            return None
+        return start
+
+    def pack_headers(self, members):
+        """Packs the headers of members into one preallocated buffer.
+
+        Every header is validated before any is packed. Returns a list of
+        60 byte memoryviews into the buffer, in the order of members.
+        """
+        values = [m.header_values() for m in members]
+        size = ArchiveMember._header_packer.size
+        buf = bytearray(size * len(members))
+        view = memoryview(buf)
+        headers = []
+        for i, (m, v) in enumerate(zip(members, values)):
+            m.pack_header(buf, i * size, v)
+            headers.append(view[i * size:(i + 1) * size])
+        return headers
+
+    def write_padding(self):
+        if self.outstream.tell() % 2 == 1:
+            self.outstream.write(self._body_pad)
 
     @staticmethod
-    def write_member(member):
+    def write_member(member, header=None):
         if member:
-            member.write_header()
+            member.write_header(header)
             member.collect()
 
     def add(self, filepath):
         member = None
-        for cls in ArchiveMember.derived():
+        for cls in _MEMBER_CLASSES:
+            if cls.format != self.format or not cls.normal:
+                continue
             try:
-                if cls.format == self.format:
-                    member = cls(self, filepath)
-                    break
+                member = cls(self, filepath)
+                break
             except WrongMemberTypeException as e:
                 log.debug("Wrong type for member: %s", e)
         if member is None:
@@ -763,14 +2393,464 @@ class Archive(object):
         return len(self.members)
 
     def __getitem__(self, filename):
-        for m in self.members:
-            if m.filename == filename:
-                return m
-        raise KeyError()
+        member = self.get(filename)
+        if member is None:
+            raise KeyError(filename)
+        return member
+
+    def __delitem__(self, filename):
+        member = self.get(filename)
+        if member is None:
+            raise KeyError(filename)
+        self.remove(member)
+
+    def _clear_index(self):
+        self._index = {}
+        self._indexed = 0
+        self._indexedlast = None
+        self._hashed = array("I")
+        self._overflowed = 0
+        self._indexmoves = 0
+
+    def _update_index(self):
+        # Members of a list are indexed by filename as they are loaded or
+        # added. A list that shrank, or whose last indexed member moved,
+        # behind the index's back is reindexed.
+        #
+        # A MemberTable is indexed without creating member objects, and in
+        # little more memory than the table: _hashed holds the position of
+        # every row, sorted on the hash of the filename stored in the table,
+        # and _index maps the names of rows indexed or renamed since then to
+        # their positions. Once _index grows as large as _hashed, every row
+        # is sorted into _hashed again.
+        members = self._members
+        table = isinstance(members, MemberTable)
+        if self._indexed > len(members) or (table and members.moves != self._indexmoves) or \
+                (not table and self._indexed and members[self._indexed - 1] is not self._indexedlast):
+            self._clear_index()
+        if table:
+            self._indexmoves = members.moves
+            pending = len(members) - self._indexed
+            if pending and self._overflowed + pending > max(len(self._hashed), self._index_overflow):
+                self._hash_table(members)
+                return
+        while self._indexed < len(members):
+            if table:
+                self._index.setdefault(members.filename(self._indexed), []).append(self._indexed)
+                self._overflowed += 1
+            else:
+                m = members[self._indexed]
+                self._index.setdefault(m.filename, []).append(m)
+            self._indexed += 1
+        if not table and self._indexed:
+            self._indexedlast = members[self._indexed - 1]
+
+    def _hash_table(self, members):
+        key = members.stored_name
+        # The sort is stable, so rows with the same hash stay in order.
+        self._hashed = array("I", sorted(range(len(members)), key=lambda i: hash(key(i))))
+        # Renamed members stay indexed under their new names.
+        renamed = {}
+        overflowed = 0
+        for filename, positions in self._index.items():
+            encoded = tobytes(filename, self.encoding, self.errors)
+            positions = [i for i in positions if i < len(members) and key(i) != encoded]
+            if positions:
+                renamed[filename] = positions
+                overflowed += len(positions)
+        self._index = renamed
+        self._overflowed = overflowed
+        self._indexed = len(members)
+
+    def _hashed_range(self, encoded):
+        # Returns the slice of _hashed whose stored filenames hash like encoded.
+        members = self._members
+        key = members.stored_name
+        hashed = self._hashed
+        h = hash(encoded)
+        lo, hi = 0, len(hashed)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if hash(key(hashed[mid])) < h:
+                lo = mid + 1
+            else:
+                hi = mid
+        end = lo
+        while end < len(hashed) and hash(key(hashed[end])) == h:
+            end += 1
+        return lo, end
+
+    def _found(self, filename):
+        # Returns the members, or for a MemberTable the positions, indexed under filename.
+        members = self._members
+        if not isinstance(members, MemberTable):
+            return self._index.get(filename, ())
+        lo, hi = self._hashed_range(tobytes(filename, self.encoding, self.errors))
+        # Rows renamed since they were indexed are skipped.
+        found = set(i for i in self._hashed[lo:hi] if members.filename(i) == filename)
+        found.update(i for i in self._index.get(filename, ()) if members.filename(i) == filename)
+        return sorted(found)
+
+    def _renamed(self, member, previous):
+        # Moves a member renamed from previous to its new name in the index.
+        members = self._members
+        if isinstance(members, MemberTable):
+            # Rows stay in _hashed under their stored names; lookups check
+            # the filename of each row they find.
+            lo, hi = self._hashed_range(tobytes(previous, self.encoding, self.errors))
+            for i in list(self._hashed[lo:hi]) + self._index.get(previous, []):
+                if members._members[i] is member:
+                    bisect.insort(self._index.setdefault(member.filename, []), i)
+                    self._overflowed += 1
+                    return
+            return
+        found = self._index.get(previous)
+        if not found:
+            return
+        for i, m in enumerate(found):
+            if m is member:
+                break
+        else:
+            return
+        del found[i]
+        if not found:
+            del self._index[previous]
+        others = self._index.setdefault(member.filename, [])
+        if others:
+            # Where it goes among the members of that name is unknown.
+            self._clear_index()
+        else:
+            others.append(member)
+
+    def _offset_index(self):
+        """Returns a dict from the header offset of each loaded member to its position."""
+        members = self.members
+        if isinstance(members, MemberTable):
+            offsets = (members.header_offset(i) for i in range(len(members)))
+        else:
+            offsets = (m.header_offset for m in members)
+        return dict((offset, i) for i, offset in enumerate(offsets) if offset is not None)
+
+    def _resolve_symbols(self, offsets, names):
+        """Maps symbol names to the members at the header offsets listed for them."""
+        index = self._offset_index()
+        members = self.members
+        resolved = {}
+        symbols = {}
+        for offset, name in zip(offsets, names):
+            member = resolved.get(offset)
+            if member is None:
+                position = index.get(offset)
+                if position is None:
+                    log.debug("No member at offset %d for symbol %r", offset, name)
+                    continue
+                member = resolved[offset] = members[position]
+            name = tostr(name, self.encoding, self.errors)
+            if name not in symbols:
+                symbols[name] = member
+        return symbols
+
+    def closure(self, undefined):
+        """Returns the members a linker would pull from the archive to resolve the symbols undefined.
+
+        Like ld, each member pulled in to define a symbol may leave more
+        symbols undefined, which are resolved in turn until none of the
+        remaining ones is defined by the archive. Members are found through
+        the symbol table, or, in an archive without one, by scanning the
+        object members in order. The result is an OrderedDict from each
+        member, in the order it was pulled in, to the symbol it was pulled
+        in for.
+        """
+        table = self.symbols
+        if table:
+            find = table.find
+        else:
+            index = {}
+            for m in self.members:
+                for name in object_symbols(m.view())[0]:
+                    index.setdefault(tostr(name, self.encoding, self.errors), m)
+            find = index.get
+
+        pulled = OrderedDict()
+        defined = set()
+        pending = deque(undefined)
+        while pending:
+            symbol = pending.popleft()
+            if symbol in defined:
+                continue
+            member = find(symbol)
+            if member is None or member in pulled:
+                continue
+            pulled[member] = symbol
+            names, references = object_symbols(member.view())
+            defined.update(tostr(name, self.encoding, self.errors) for name in names)
+            defined.add(symbol)
+            pending.extend(tostr(name, self.encoding, self.errors) for name in references)
+        return pulled
+
+    def get(self, filename, default=None, count=1):
+        """Returns the count-th member named filename (like "ar N"), or default."""
+        self._update_index()
+        found = self._found(filename)
+        while len(found) < count and self._load_next():
+            self._update_index()
+            found = self._found(filename)
+        if len(found) < count:
+            return default
+        if not isinstance(self._members, MemberTable):
+            return found[count - 1]
+        return self._members[found[count - 1]]
+
+    def remove(self, member):
+        """Removes a member from the archive."""
+        log.debug("Removing member %r", member)
+        self._update_index()
+        members = self._members
+        position = members.index(member)
+        del members[position]
+        if isinstance(members, MemberTable):
+            # Removing from a table is linear anyway; renumber the positions after it.
+            self._indexmoves = members.moves
+            renumber = lambda positions: [i - 1 if i > position else i for i in positions if i != position]
+            self._hashed = array("I", renumber(self._hashed))
+            for filename, positions in list(self._index.items()):
+                renumbered = renumber(positions)
+                self._overflowed -= len(positions) - len(renumbered)
+                if renumbered:
+                    self._index[filename] = renumbered
+                else:
+                    del self._index[filename]
+        else:
+            found = self._index.get(member.filename, [])
+            found[:] = [m for m in found if m is not member]
+            if not found:
+                self._index.pop(member.filename, None)
+            self._indexedlast = members[self._indexed - 2] if self._indexed > 1 else None
+        self._indexed -= 1
+        if self._strings is not None:
+            del self._strings[member]
 
     def __iter__(self):
-        return iter(self.members)
+        index = 0
+        while True:
+            if index < len(self._members):
+                yield self._members[index]
+                index += 1
+            elif not self._load_next():
+                break
+
+    def extract_all(self, path, workers=1):
+        """Extracts every member into the directory path.
+
+        With workers greater than 1, members are extracted concurrently by a
+        pool of that many threads, each reading its members through the
+        archive's Reader.
+        """
+        members = self.members
+        if workers <= 1:
+            for m in members:
+                m.extract(path)
+            return
 
-    def extract_all(self, path):
-        for m in self.members:
-            m.extract(path)
+        try:
+            os.makedirs(os.path.abspath(path))
+        except OSError:
+            pass
+        pool = ThreadPool(min(workers, len(members)) or 1)
+        try:
+            pool.map(lambda m: m.extract(path), members, 1)
+        finally:
+            pool.close()
+            pool.join()
+
+# A member as listed by iter_headers(): its filename, the offset and size of
+# its payload, and its date, uid, gid and mode.
+MemberInfo = namedtuple("MemberInfo", "name offset size date uid gid mode")
+
+def iter_headers(filething, encoding="utf-8", decode=True, errors="strict"):
+    """Yields a MemberInfo for each member of an archive, like "ar t".
+
+    This is a fast path for listing that builds no ArchiveMember objects.
+    Headers are unpacked in place from a memory mapping of the archive (or
+    from its contents read at once when it cannot be mapped), and symbol
+    and string tables are skipped. With decode false, the date, uid, gid
+    and mode are left as the raw, stripped header fields. Names are decoded
+    with the given encoding and errors handler, as for Archive.
+    """
+    if isstring(filething):
+        with open(filething, "rb") as f:
+            for info in iter_headers(f, encoding, decode, errors):
+                yield info
+        return
+
+    # Offsets are those in the file; a read archive starts at data[0].
+    start = _tell(filething)
+    fileno = _fileno(filething)
+    if fileno is not None and os.fstat(fileno).st_size > 0:
+        data = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        base = 0
+    else:
+        data = filething.read()
+        base = start
+    start -= base
+    try:
+        if data[start:start + len(Archive._magic)] != Archive._magic:
+            raise InvalidArchiveException("{0}: invalid magic".format(filething))
+
+        header_format = ArchiveMember._header_format
+        header_size = header_format.size
+        unpack_from = header_format.unpack_from
+        tail = ArchiveMember._header_tail
+        bsdprefix = BSDLongMember._name_prefix.encode("ascii")
+        symdef = BSDSymbolTable._name_literal.encode("ascii")
+        strings = None
+        names = None
+        end = len(data)
+        pos = start + len(Archive._magic)
+        while pos + header_size <= end:
+            rawname, date, uid, gid, mode, size, magic = unpack_from(data, pos)
+            here = base + pos
+            if magic != tail:
+                raise InvalidArchiveException("Invalid member header at offset {0}".format(here))
+            try:
+                size = int(size)
+            except ValueError:
+                raise InvalidArchiveException("Invalid size for member at offset {0}".format(here))
+            offset = pos + header_size
+            pos = offset + size + ((base + offset + size) & 1)
+
+            rawname = rawname.rstrip(b" ")
+            if rawname.startswith(b"/"):
+                if rawname == b"//":
+                    strings = data[offset:offset + size]
+                    names = GNUStringTable.split(strings)
+                    continue
+                if not rawname[1:].isdigit():
+                    continue
+                if strings is None:
+                    raise InvalidArchiveException("Long name without a string table at offset {0}".format(here))
+                name = GNUStringTable.lookup(strings, names, int(rawname[1:]))
+            elif rawname.startswith(bsdprefix):
+                try:
+                    namelength = int(rawname[len(bsdprefix):])
+                except ValueError:
+                    raise InvalidArchiveException("Invalid BSD name length for member at offset {0}".format(here))
+                name = data[offset:offset + namelength].rstrip(b"\x00")
+                offset += namelength
+                size -= namelength
+            elif rawname.endswith(b"/"):
+                name = rawname[:-1]
+            else:
+                name = rawname
+            if name.startswith(symdef):
+                continue
+
+            if decode:
+                try:
+                    fields = int(date), int(uid), int(gid), int(mode, 8)
+                except ValueError:
+                    raise InvalidArchiveException("Invalid header fields for member '{0}' at offset {1}".format(
+                        name.decode(encoding, errors), here))
+                yield MemberInfo(name.decode(encoding, errors), base + offset, size, *fields)
+            else:
+                yield MemberInfo(name.decode(encoding, errors), base + offset, size,
+                                 date.strip(), uid.strip(), gid.strip(), mode.strip())
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+# ELF and Mach-O constants used to find the global symbols of an object.
+_ELF_MAGIC = b"\x7fELF"
+_SHT_SYMTAB = 2
+_STB_GLOBAL_BINDINGS = (1, 2, 10)   # STB_GLOBAL, STB_WEAK, STB_GNU_UNIQUE
+_STB_WEAK = 2
+_MACHO_MAGICS = {
+    b"\xfe\xed\xfa\xce": (">", False), b"\xce\xfa\xed\xfe": ("<", False),
+    b"\xfe\xed\xfa\xcf": (">", True), b"\xcf\xfa\xed\xfe": ("<", True),
+}
+_LC_SYMTAB = 0x2
+_N_STAB = 0xe0
+_N_TYPE = 0x0e
+_N_EXT = 0x01
+_N_WEAK_REF = 0x0040
+
+def _cstring(data, start):
+    end = data.find(b"\0", start)
+    return data[start:end if end >= 0 else len(data)]
+
+def _elf_symbols(data):
+    order = "<" if data[5:6].tobytes() == b"\x01" else ">"
+    if data[4:5].tobytes() == b"\x02":
+        shoff, = struct.unpack_from(order + "Q", data, 0x28)
+        shentsize, shnum = struct.unpack_from(order + "HH", data, 0x3a)
+        section = struct.Struct(order + "IIQQQQIIQQ")
+        symbol = struct.Struct(order + "IBBHQQ")
+        fields = lambda s: (s[0], s[1], s[3])
+    else:
+        shoff, = struct.unpack_from(order + "I", data, 0x20)
+        shentsize, shnum = struct.unpack_from(order + "HH", data, 0x2e)
+        section = struct.Struct(order + "IIIIIIIIII")
+        symbol = struct.Struct(order + "IIIBBH")
+        fields = lambda s: (s[0], s[3], s[5])
+
+    defined, undefined = [], []
+    sections = [section.unpack_from(data, shoff + i * shentsize) for i in range(shnum)]
+    for sh in sections:
+        if sh[1] != _SHT_SYMTAB:
+            continue
+        strtab = sections[sh[6]]
+        strings = data[strtab[4]:strtab[4] + strtab[5]].tobytes()
+        # Local symbols come first; sh_info is the index of the first global one.
+        for i in range(sh[7], sh[5] // symbol.size):
+            name, info, shndx = fields(symbol.unpack_from(data, sh[4] + i * symbol.size))
+            if info >> 4 not in _STB_GLOBAL_BINDINGS or not name:
+                continue
+            if shndx:
+                defined.append(_cstring(strings, name))
+            elif info >> 4 != _STB_WEAK:
+                undefined.append(_cstring(strings, name))
+    return defined, undefined
+
+def _macho_symbols(data, order, wide):
+    header = struct.Struct(order + "7I")
+    ncmds = header.unpack_from(data, 0)[4]
+    pos = header.size + (4 if wide else 0)
+    command = struct.Struct(order + "II")
+    nlist = struct.Struct(order + ("IBBHQ" if wide else "IBBHI"))
+
+    defined, undefined = [], []
+    for i in range(ncmds):
+        cmd, cmdsize = command.unpack_from(data, pos)
+        if cmd == _LC_SYMTAB:
+            symoff, nsyms, stroff, strsize = struct.unpack_from(order + "4I", data, pos + command.size)
+            strings = data[stroff:stroff + strsize].tobytes()
+            for j in range(nsyms):
+                strx, ntype, sect, desc, value = nlist.unpack_from(data, symoff + j * nlist.size)
+                if ntype & _N_STAB or not ntype & _N_EXT:
+                    continue
+                if ntype & _N_TYPE or value:
+                    defined.append(_cstring(strings, strx))
+                elif not desc & _N_WEAK_REF:
+                    undefined.append(_cstring(strings, strx))
+        pos += cmdsize
+    return defined, undefined
+
+def object_symbols(data):
+    """Returns the global symbols an ELF or Mach-O object defines and those it leaves undefined.
+
+    Both are lists of names as bytes, in symbol table order. Weak and
+    common symbols count as defined. Weak references are not listed as
+    undefined, since a linker does not pull archive members to resolve
+    them. Data that is not an object file has no symbols; a malformed
+    object raises InvalidArchiveException.
+    """
+    try:
+        data = memoryview(data)
+        magic = data[:4].tobytes()
+        if magic == _ELF_MAGIC:
+            return _elf_symbols(data)
+        if magic in _MACHO_MAGICS:
+            return _macho_symbols(data, *_MACHO_MAGICS[magic])
+    except (struct.error, IndexError) as e:
+        raise InvalidArchiveException("Malformed object file: {0}".format(e))
+    return [], []
@@ -1,13 +1,36 @@
+import gc
+import io
 import logging
+import mmap
 import os
 import shutil
+import struct
+import sys
+import tarfile
 import tempfile
+import threading
 import unittest
+from multiprocessing.pool import ThreadPool
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 import arlib
 
 logging.getLogger("arlib").setLevel(logging.DEBUG)
 
+def member_header(name, size, date=0, uid=0, gid=0, mode=100644):
+    """Returns a member header for a hand-built archive; name may be text or bytes."""
+    if not isinstance(name, bytes):
+        name = name.encode("ascii")
+    return name.ljust(16) + "{0:<12}{1:<6}{2:<6}{3:<8}{4:<10}`\n".format(date, uid, gid, mode, size).encode("ascii")
+
 class ArLibTestCase(unittest.TestCase):
     def setUp(self):
         self.temp_dir = tempfile.mkdtemp()
@@ -74,6 +97,886 @@ class ArLibTestCase(unittest.TestCase):
             self.assertEqual(s.st_size, arc[f].filesize)
             self.assertEqual(s.st_mtime, arc[f].date)
 
+    def test_member_type_dispatch(self):
+        arc = arlib.Archive()
+        arc.load("test_subjects/gnu1.a")
+        self.assertIsInstance(arc.symbols, arlib.GNUSymbolTable)
+        self.assertIsInstance(arc.strings, arlib.GNUStringTable)
+        self.assertIsInstance(arc["test.o"], arlib.GNUShortMember)
+        self.assertIsInstance(arc["this_is_a_long_file_name.o"], arlib.GNULongMember)
+
+        arc = arlib.Archive()
+        arc.load("test_subjects/bsd1.a")
+        self.assertIsInstance(arc.symbols, arlib.BSDSymbolTable)
+        self.assertTrue(arc.symbols.sorted)
+        self.assertIsInstance(arc["this_is_a_long_file_name.o"], arlib.BSDLongMember)
+
+        arc = arlib.Archive()
+        arc.load("test_subjects/test.deb", lazy=True)
+        self.assertEqual(arc.read_member().filename, "debian-binary")
+        self.assertEqual(arc.read_member().filename, "control.tar.xz")
+        self.assertEqual(len(arc._members), 0)
+        self.assertEqual(arlib.DEBShortMember(arc).filename, "data.tar.xz")
+        self.assertIs(arc.read_member(), None)
+        self.assertRaises(EOFError, arlib.DEBShortMember, arc)
+
+    def test_gnu_string_table(self):
+        strings = b"first_long_member_name.o/\nsecond_long_member_nam.o/\n"
+        data = b"!<arch>\n" + member_header("//", len(strings)) + strings + \
+            member_header("/26", 2) + b"ab" + member_header("/0", 2) + b"cd"
+        arc = arlib.Archive()
+        arc.load(io.BytesIO(data))
+        self.assertEqual([m.filename for m in arc], ["second_long_member_nam.o", "first_long_member_name.o"])
+
+        # Offsets follow removals and renames without a pass over the
+        # entries until half of them have been removed.
+        reindex = arlib.GNUStringTable._reindex
+        passes = []
+        def counting_reindex(table):
+            passes.append(table)
+            reindex(table)
+        arlib.GNUStringTable._reindex = counting_reindex
+        try:
+            table = arlib.Archive().strings
+            keys = [object() for i in range(40)]
+            names = dict((key, "long_member_name_{0}.o".format(i) * (1 + i % 3)) for i, key in enumerate(keys))
+            for key in keys:
+                table[key] = names[key]
+            def check():
+                offset = 0
+                for key in keys:
+                    self.assertEqual(table.string_offset(key), offset)
+                    offset += len(names[key]) + 2
+                self.assertEqual(table.size, offset)
+                self.assertEqual(len(table.payload()), offset)
+            for i in range(19):
+                del table[keys.pop((i * 7) % len(keys))]
+                check()
+            names[keys[3]] = "renamed.o"
+            table[keys[3]] = "renamed.o"
+            check()
+            self.assertEqual(len(passes), 0)
+            for i in range(3):
+                del table[keys.pop(0)]
+                check()
+            self.assertEqual(len(passes), 1)
+        finally:
+            arlib.GNUStringTable._reindex = reindex
+
+        strings = b"unterminated_member_name.o"
+        data = b"!<arch>\n" + member_header("//", len(strings)) + strings + member_header("/0", 2) + b"ab"
+        arc = arlib.Archive()
+        self.assertRaises(arlib.InvalidArchiveException, arc.load, io.BytesIO(data))
+
+    def test_gnu_symbol_table(self):
+        expected = {"alpha": "alpha.o", "another_long_file_name": "another_long_file_name.o", "a_function": "test.o",
+                    "test": "test.o", "this_is_a_function_with_a_much_longer_name_than_the_others": "test.o",
+                    "this_is_a_long_file_name": "this_is_a_long_file_name.o", "zeta": "zeta.o"}
+        for options in [{}, {"use_mmap": True}, {"compact": True}, {"lazy": True}]:
+            arc = arlib.Archive()
+            arc.load("test_subjects/gnu1.a", **options)
+            symbols = arc.symbols.symbol_map()
+            self.assertEqual(dict((name, m.filename) for name, m in symbols.items()), expected)
+            self.assertIs(arc.symbols.find("a_function"), arc["test.o"])
+            self.assertIsNone(arc.symbols.find("puts"))
+            self.assertIs(arc.symbols.symbol_map(), symbols)
+
+        data = b"\x00\x00\x00\x02\x00\x00\x00\x08\x00\x00\x00\x48foo\x00bar\x00"
+        offsets, names = arlib.GNUSymbolTable.parse(data)
+        self.assertEqual((list(offsets), names), ([8, 72], [b"foo", b"bar"]))
+        self.assertRaises(arlib.InvalidArchiveException, arlib.GNUSymbolTable.parse, data[:10])
+        self.assertRaises(arlib.InvalidArchiveException, arlib.GNUSymbolTable.parse, data[:16])
+
+    def test_bsd_symbol_table(self):
+        arc = arlib.Archive()
+        arc.load("test_subjects/bsd1.a")
+        self.assertTrue(arc.symbols.sorted)
+        self.assertIs(arc.symbols.find("_a_function"), arc["test.o"])
+        self.assertIs(arc.symbols.find("_this_is_a_long_file_name"), arc["this_is_a_long_file_name.o"])
+        self.assertIsNone(arc.symbols.find("_puts"))
+        self.assertIsNone(arc.symbols._symbols)
+        self.assertEqual(dict((name, m.filename) for name, m in arc.symbols.symbol_map().items()),
+                         {"_a_function": "test.o", "_alpha": "alpha.o", "_another_long_file_name": "another_long_file_name.o",
+                          "_test": "test.o", "_this_is_a_function_with_a_much_longer_name_than_the_others": "test.o",
+                          "_this_is_a_long_file_name": "this_is_a_long_file_name.o", "_zeta": "zeta.o"})
+
+        def archive(symdef, code, symbols):
+            strings = b"".join(name + b"\0" for name, member in symbols)
+            word = struct.calcsize(code[1])
+            size = 4 * word + len(strings) + 2 * word * len(symbols)
+            offsets = {"a.o": 8 + 60 + size, "b.o": 8 + 60 + size + 62}
+            entries, strx = b"", 0
+            for name, member in symbols:
+                entries += struct.pack(code[0] + code[1] * 2, strx, offsets[member])
+                strx += len(name) + 1
+            payload = struct.pack(code, len(entries)) + entries + struct.pack(code, len(strings)) + strings
+            payload = payload.ljust(size, b"\0")
+            return b"!<arch>\n" + member_header(symdef, len(payload)) + payload + \
+                member_header("a.o", 2) + b"ab" + member_header("b.o", 2) + b"cd"
+
+        symbols = [(b"_b", "b.o"), (b"_a", "a.o"), (b"_b2", "b.o")]
+        for symdef, code in [("__.SYMDEF", "<I"), ("__.SYMDEF_64", ">Q"), ("__.SYMDEF SORTED", "<I")]:
+            data = archive(symdef, code, sorted(symbols) if "SORTED" in symdef else symbols)
+            arc = arlib.Archive()
+            arc.load(io.BytesIO(data))
+            self.assertEqual(arc.format, arlib.BSD)
+            self.assertEqual(arc.symbols.name, symdef)
+            self.assertEqual(arc.symbols.wide, "_64" in symdef)
+            self.assertEqual(arc.symbols.sorted, "SORTED" in symdef)
+            for name, member in symbols:
+                self.assertIs(arc.symbols.find(name.decode("ascii")), arc[member])
+            self.assertIsNone(arc.symbols.find("_c"))
+            self.assertIsNone(arc.symbols.find("_"))
+            self.assertIsNone(arc.symbols.find("_z"))
+
+            out = io.BytesIO()
+            arc.save(out)
+            self.assertEqual(out.getvalue(), data)
+
+        self.assertRaises(arlib.InvalidArchiveException, arlib.BSDSymbolTable.parse, b"\x10\x00\x00\x00\x00\x00\x00\x00")
+
+    def test_building_symbol_index(self):
+        for path, symbol, function in [("test_subjects/gnu1.a", "/", "a_function"),
+                                       ("test_subjects/bsd1.a", "__.SYMDEF SORTED", "_a_function")]:
+            arc = arlib.Archive()
+            arc.load(path)
+            expected = dict((name, m.filename) for name, m in arc.symbols.symbol_map().items())
+            defined, undefined = arlib.object_symbols(arc["test.o"].view())
+            self.assertIn(function.encode("ascii"), defined)
+            self.assertIn(b"printf" if function == "a_function" else b"_printf", undefined)
+
+            # Rebuild the index of an archive with the tables dropped and the members reordered.
+            source = os.path.join(self.temp_dir, "source")
+            arc.extract_all(source)
+            filenames = [m.filename for m in reversed(list(arc))]
+            outpath = os.path.join(self.temp_dir, "rebuilt.a")
+            for workers in [1, 4]:
+                rebuilt = arlib.Archive(arc.format)
+                for filename in filenames:
+                    rebuilt.add(os.path.join(source, filename))
+                rebuilt.save(outpath, workers, build_symbol_index=True)
+                arc = arlib.Archive()
+                arc.load(outpath)
+                self.assertEqual(getattr(arc.symbols, "symdef", arc.symbols.name), symbol)
+                symbols = dict((name, m.filename) for name, m in arc.symbols.symbol_map().items())
+                for name, filename in expected.items():
+                    self.assertEqual(symbols[name], filename)
+                self.assertIs(arc.symbols.find(function), arc["test.o"])
+
+        self.assertEqual(arlib.object_symbols(b"not an object"), ([], []))
+        self.assertRaises(arlib.InvalidArchiveException, arlib.object_symbols, b"\x7fELF\x02\x01")
+
+    def test_sym64_symbol_table(self):
+        arc = arlib.Archive()
+        arc.load("test_subjects/gnu1.a")
+        expected = dict((name, m.filename) for name, m in arc.symbols.symbol_map().items())
+        self.assertNotIsInstance(arc.symbols, arlib.GNUSymbolTable64)
+
+        # Pretend every offset past the first member header overflows 32 bits.
+        limit = arlib._SYM64_OFFSET
+        arlib._SYM64_OFFSET = 8 + 60
+        try:
+            outpath = os.path.join(self.temp_dir, "sym64.a")
+            arc.save(outpath, build_symbol_index=True)
+        finally:
+            arlib._SYM64_OFFSET = limit
+        with open(outpath, "rb") as f:
+            self.assertEqual(f.read(8 + 16), b"!<arch>\n/SYM64/         ")
+
+        for options in [{}, {"compact": True}, {"lazy": True}]:
+            arc = arlib.Archive()
+            arc.load(outpath, **options)
+            self.assertIsInstance(arc.symbols, arlib.GNUSymbolTable64)
+            self.assertEqual(dict((name, m.filename) for name, m in arc.symbols.symbol_map().items()), expected)
+            self.assertIs(arc.symbols.find("zeta"), arc["zeta.o"])
+
+            out = io.BytesIO()
+            arc.save(out)
+            with open(outpath, "rb") as f:
+                self.assertTrue(out.getvalue() == f.read())
+
+        data = b"\x00" * 7 + b"\x01" + b"\x00\x00\x00\x01\x00\x00\x00\x08foo\x00"
+        offsets, names = arlib.GNUSymbolTable64.parse(data)
+        self.assertEqual((list(offsets), names), ([(1 << 32) + 8], [b"foo"]))
+        self.assertRaises(arlib.InvalidArchiveException, arlib.GNUSymbolTable64.parse, data[:12])
+
+    def test_member_closure(self):
+        def elf(defined, undefined, weak=()):
+            strings, symbols = b"\0", b"\0" * 24
+            for names, binding, shndx in [(defined, 1, 1), (undefined, 1, 0), (weak, 2, 0)]:
+                for name in names:
+                    symbols += struct.pack("<IBBHQQ", len(strings), binding << 4, 0, shndx, 0, 0)
+                    strings += name.encode("ascii") + b"\0"
+            sections = b"\0" * 64 + struct.pack("<IIQQQQIIQQ", 0, 2, 0, 0, 64, len(symbols), 2, 1, 8, 24) + \
+                struct.pack("<IIQQQQIIQQ", 0, 3, 0, 0, 64 + len(symbols), len(strings), 0, 0, 1, 0)
+            header = struct.pack("<16sHHIQQQIHHHHHH", b"\x7fELF\x02\x01\x01", 1, 62, 1, 0, 0,
+                                 64 + len(symbols) + len(strings), 0, 64, 0, 0, 64, 3, 0)
+            return header + symbols + strings + sections
+
+        objects = [("main.o", elf(["main"], ["parse", "log"])),
+                   ("parse.o", elf(["parse"], ["lex", "main"], weak=["trace"])),
+                   ("lex.o", elf(["lex", "log"], [])),
+                   ("log.o", elf(["log"], ["lex"])),
+                   ("trace.o", elf(["trace"], ["unused"])),
+                   ("unused.o", elf(["unused"], []))]
+        self.assertEqual(arlib.object_symbols(objects[1][1]), ([b"parse"], [b"lex", b"main"]))
+
+        arc = arlib.Archive()
+        for name, data in objects:
+            with open(os.path.join(self.temp_dir, name), "wb") as f:
+                f.write(data)
+            arc.add(os.path.join(self.temp_dir, name))
+        expected = [("parse.o", "parse"), ("lex.o", "lex"), ("main.o", "main")]
+        self.assertIsNone(arc.symbols)
+        self.assertEqual([(m.filename, s) for m, s in arc.closure(["parse", "missing"]).items()], expected)
+
+        outpath = os.path.join(self.temp_dir, "closure.a")
+        arc.save(outpath, build_symbol_index=True)
+        arc = arlib.Archive()
+        arc.load(outpath)
+        self.assertEqual([(m.filename, s) for m, s in arc.closure(["parse", "missing"]).items()], expected)
+        self.assertEqual([m.filename for m in arc.closure(["main"])], ["main.o", "parse.o", "lex.o"])
+        self.assertEqual([m.filename for m in arc.closure(["log"])], ["lex.o"])
+        self.assertEqual(list(arc.closure([])), [])
+
+    def test_undecodable_names(self):
+        if sys.version_info[0] < 3:
+            self.skipTest("Python 2 names are not decoded")
+        strings = b"long_member_name_\xe9t\xe9.o/\n"
+        data = b"!<arch>\n" + member_header(b"//", len(strings)) + strings + \
+            member_header(b"caf\xe9.o/", 2) + b"ab" + member_header(b"/0", 2) + b"cd"
+        arc = arlib.Archive()
+        self.assertRaises(UnicodeDecodeError, arc.load, io.BytesIO(data))
+
+        arc = arlib.Archive(errors="surrogateescape")
+        arc.load(io.BytesIO(data))
+        self.assertEqual([m.filename for m in arc], ["caf\udce9.o", "long_member_name_\udce9t\udce9.o"])
+        member = arc.members[0]
+        self.assertIs(member.filename, member.filename)
+        member.filename = "renamed.o"
+        self.assertEqual(member.filename, "renamed.o")
+        self.assertEqual([info.name for info in arlib.iter_headers(io.BytesIO(data), errors="surrogateescape")],
+                         ["caf\udce9.o", "long_member_name_\udce9t\udce9.o"])
+
+        outpath = os.path.join(self.temp_dir, "undecodable.a")
+        arc = arlib.Archive(errors="surrogateescape")
+        arc.load(io.BytesIO(data))
+        arc.save(outpath)
+        arc.outstream.close()
+        with open(outpath, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_mmap_loading(self):
+        for path in ["test_subjects/gnu1.a", "test_subjects/bsd1.a", "test_subjects/test.deb"]:
+            arc = arlib.Archive()
+            arc.load(path)
+            mapped = arlib.Archive()
+            mapped.load(path, use_mmap=True)
+            self.assertEqual(mapped.format, arc.format)
+            self.assertEqual([m.filename for m in mapped], [m.filename for m in arc])
+            for m in mapped:
+                view = m.view()
+                self.assertEqual(view.tobytes(), arc[m.filename].view().tobytes())
+                if hasattr(view, "obj"):
+                    # Python 2 views are copies rather than slices of the mapping.
+                    self.assertEqual(view.obj, mapped.mapping)
+                    view.release()
+
+        mapped = arlib.Archive()
+        mapped.load("test_subjects/test.deb", use_mmap=True)
+        with open("test_subjects/deb_source/debian-binary", "rb") as f:
+            self.assertEqual(mapped["debian-binary"].view().tobytes(), f.read())
+        mapped.extract_all(self.temp_dir)
+        self.assertEqual(os.path.getsize(os.path.join(self.temp_dir, "data.tar.xz")), mapped["data.tar.xz"].filesize)
+
+    def test_lazy_loading(self):
+        with open("test_subjects/test.deb", "rb") as f:
+            data = f.read()
+        # Corrupt the header of the last member; a lazy lookup of the first
+        # member must never reach it.
+        offset = data.rindex(b"data.tar.xz")
+        data = data[:offset] + b"X" * 60 + data[offset + 60:]
+
+        arc = arlib.Archive()
+        arc.load(io.BytesIO(data), lazy=True)
+        self.assertEqual(arc["debian-binary"].view().tobytes(), b"2.0\n")
+        self.assertEqual(arc.format, arlib.DEB)
+        self.assertEqual(arc["control.tar.xz"].filename, "control.tar.xz")
+        self.assertRaises(arlib.InvalidArchiveException, len, arc)
+        self.assertRaises(arlib.InvalidArchiveException, len, arc)
+        self.assertRaises(arlib.InvalidArchiveException, arc.get, "data.tar.xz")
+
+        arc = arlib.Archive()
+        arc.load("test_subjects/gnu1.a", lazy=True)
+        self.assertEqual(len(arc), 5)
+        self.assertEqual(arc.format, arlib.GNU)
+
+        # Saving reads the tables of the archive rather than creating them.
+        arc = arlib.Archive()
+        arc.load("test_subjects/gnu1.a")
+        expected = io.BytesIO()
+        arc.save(expected)
+        arc = arlib.Archive()
+        arc.load("test_subjects/gnu1.a", lazy=True)
+        out = io.BytesIO()
+        arc.save(out)
+        self.assertTrue(out.getvalue() == expected.getvalue())
+
+    def test_resaving_archive(self):
+        for path in ["test_subjects/gnu1.a", "test_subjects/bsd1.a", "test_subjects/test.deb"]:
+            arc = arlib.Archive()
+            arc.load(path)
+            contents = [(m.filename, m.view().tobytes()) for m in arc]
+            outpath = os.path.join(self.temp_dir, os.path.basename(path))
+            arc.save(outpath)
+            arc.outstream.close()
+
+            d = arlib.Archive()
+            d.load(outpath)
+            self.assertEqual([(m.filename, m.view().tobytes()) for m in d], contents)
+
+    def test_saving_twice(self):
+        arc = arlib.Archive()
+        arc.load("test_subjects/gnu1.a")
+        expected = dict((m.filename, m.view().tobytes()) for m in arc)
+        arc.remove(arc["alpha.o"])
+        arc.add("test_subjects/source/alpha.c")
+        with open("test_subjects/source/alpha.c", "rb") as f:
+            expected["alpha.c"] = f.read()
+        del expected["alpha.o"]
+        for i, workers in enumerate([1, 4, 1]):
+            outpath = os.path.join(self.temp_dir, "saved%d.a" % i)
+            arc.save(outpath, workers, build_symbol_index=(i == 2))
+            arc.outstream.close()
+            self.assertEqual(arc["zeta.o"].view().tobytes(), expected["zeta.o"])
+            d = arlib.Archive()
+            d.load(outpath)
+            self.assertEqual(dict((m.filename, m.view().tobytes()) for m in d), expected)
+        self.assertIs(arc.symbols.find("zeta"), arc["zeta.o"])
+
+    def test_updating_archive(self):
+        newfile = os.path.join(self.temp_dir, "new.c")
+        with open(newfile, "wb") as f:
+            f.write(b"int new;\n")
+
+        def edited(source, edit, use_mmap=False):
+            arc = arlib.Archive()
+            arc.load(source, use_mmap=use_mmap)
+            edit(arc)
+            return arc
+
+        def saved(source, edit):
+            outpath = os.path.join(self.temp_dir, "expected.a")
+            arc = edited(source, edit)
+            arc.save(outpath)
+            arc.outstream.close()
+            with open(outpath, "rb") as f:
+                return f.read()
+
+        remove = lambda arc: arc.remove(arc["test.o"])
+        append = lambda arc: arc.add(newfile)
+        for subject in ["gnu1.a", "bsd1.a"]:
+            # Start from archives as written by arlib, whose tables may have
+            # headers that differ from those of other tools.
+            original = saved(os.path.join("test_subjects", subject), lambda arc: None)
+            source = os.path.join(self.temp_dir, "original.a")
+            with open(source, "wb") as f:
+                f.write(original)
+            for use_mmap in [False, True]:
+                path = os.path.join(self.temp_dir, subject)
+                shutil.copy(source, path)
+
+                # Removing a member in the middle rewrites the archive to a
+                # new file, copying the unchanged members in two runs.
+                calls = []
+                copy = arlib._copy_range_at
+                def counting_copy(*args):
+                    calls.append(args)
+                    return copy(*args)
+                inode = os.stat(path).st_ino
+                arc = edited(path, remove, use_mmap)
+                arlib._copy_range_at = counting_copy
+                try:
+                    arc.update(path)
+                finally:
+                    arlib._copy_range_at = copy
+                self.assertEqual(len(calls), 2)
+                self.assertNotEqual(os.stat(path).st_ino, inode)
+                with open(path, "rb") as f:
+                    self.assertEqual(f.read(), saved(source, remove))
+                self.assertEqual(arc["zeta.o"].view().tobytes(), edited(path, lambda arc: None)["zeta.o"].view().tobytes())
+
+                # Appending and then removing a member at the end happens in place.
+                shutil.copy(source, path)
+                inode = os.stat(path).st_ino
+                arc = edited(path, append, use_mmap)
+                arc.update(path)
+                self.assertEqual(os.stat(path).st_ino, inode)
+                with open(path, "rb") as f:
+                    self.assertEqual(f.read(), saved(source, append))
+                self.assertEqual(arc["new.c"].view().tobytes(), b"int new;\n")
+
+                # A mapped archive is rewritten rather than truncated under a
+                # view of its tail.
+                tail = arc["new.c"].view()
+                arc.remove(arc["new.c"])
+                arc.update(path)
+                self.assertEqual(os.stat(path).st_ino == inode, not use_mmap)
+                with open(path, "rb") as f:
+                    self.assertEqual(f.read(), original)
+                self.assertEqual(tail.tobytes(), b"int new;\n")
+                del tail
+
+                # Updating closes the file or mapping it reads from.
+                if os.path.isdir("/proc/self/fd"):
+                    arc = edited(path, append, use_mmap)
+                    # Files left to the collector by earlier tests would skew the count.
+                    gc.collect()
+                    descriptors = len(os.listdir("/proc/self/fd"))
+                    arc.update(path)
+                    arc.update(path)
+                    gc.collect()
+                    self.assertEqual(len(os.listdir("/proc/self/fd")), descriptors)
+
+    def test_buffered_copy(self):
+        with open("test_subjects/test.deb", "rb") as f:
+            data = f.read()
+        arc = arlib.Archive(blocksize=1000)
+        self.assertEqual(arc.buffers.blocksize % mmap.PAGESIZE, 0)
+        arc.load(io.BytesIO(data))
+        arc.extract_all(self.temp_dir)
+        for m in arc:
+            with open(os.path.join(self.temp_dir, m.filename), "rb") as f:
+                self.assertEqual(f.read(), m.view().tobytes())
+
+        # Buffers are returned to the pool and reused.
+        buf = arc.buffers.acquire()
+        arc.buffers.release(buf)
+        expected = arc["data.tar.xz"].view().tobytes()
+        arc.outstream = io.BytesIO()
+        arc["data.tar.xz"].collect()
+        self.assertIs(arc.buffers.acquire(), buf)
+        self.assertEqual(arc.outstream.getvalue(), expected)
+
+    def test_gather_write_save(self):
+        if not hasattr(os, "writev"):
+            self.skipTest("os.writev() is not available")
+        sourcedir = os.path.join(self.temp_dir, "source")
+        os.mkdir(sourcedir)
+        c = arlib.Archive(format=arlib.GNU)
+        for i in range(300):
+            name = "long_object_file_{0}.o".format(i) if i % 2 else "obj{0}.o".format(i)
+            with open(os.path.join(sourcedir, name), "wb") as f:
+                f.write(os.urandom(i % 7 + 1))
+            c.add(os.path.join(sourcedir, name))
+        with open(os.path.join(sourcedir, "big.o"), "wb") as f:
+            f.write(os.urandom(arlib._GATHERSIZE * 3 + 1))
+        c.add(os.path.join(sourcedir, "big.o"))
+
+        calls = []
+        writev = os.writev
+        def counting_writev(fd, buffers):
+            calls.append(len(buffers))
+            return writev(fd, buffers)
+        outpath = os.path.join(self.temp_dir, "gathered.a")
+        os.writev = counting_writev
+        try:
+            c.save(outpath)
+        finally:
+            os.writev = writev
+        c.outstream.close()
+        self.assertLessEqual(len(calls), 5)
+        self.assertLessEqual(max(calls), arlib._IOV_MAX)
+
+        expected = {}
+        for name in os.listdir(sourcedir):
+            with open(os.path.join(sourcedir, name), "rb") as f:
+                expected[name] = f.read()
+        d = arlib.Archive()
+        d.load(outpath)
+        self.assertEqual(sorted(m.filename for m in d), sorted(expected))
+        for m in d:
+            self.assertTrue(m.view().tobytes() == expected[m.filename], m.filename)
+
+        # Large members copied through pooled buffers are written before the
+        # buffer is reused.
+        copiers = arlib._copy_file_range, arlib._sendfile
+        arlib._copy_file_range = arlib._sendfile = None
+        try:
+            d = arlib.Archive(blocksize=4096)
+            d.load(outpath)
+            d.save(os.path.join(self.temp_dir, "buffered.a"))
+            d.outstream.close()
+        finally:
+            arlib._copy_file_range, arlib._sendfile = copiers
+        d = arlib.Archive()
+        d.load(os.path.join(self.temp_dir, "buffered.a"))
+        self.assertEqual(sorted(m.filename for m in d), sorted(expected))
+        for m in d:
+            self.assertTrue(m.view().tobytes() == expected[m.filename], m.filename)
+
+    def test_parallel_extract(self):
+        for path in ["test_subjects/gnu1.a", "test_subjects/bsd1.a", "test_subjects/test.deb"]:
+            for use_mmap in [False, True]:
+                arc = arlib.Archive()
+                arc.load(path, use_mmap=use_mmap)
+                outdir = os.path.join(self.temp_dir, os.path.basename(path) + str(use_mmap))
+                arc.extract_all(outdir, workers=4)
+                for m in arc:
+                    filepath = os.path.join(outdir, m.filename)
+                    with open(filepath, "rb") as f:
+                        self.assertEqual(f.read(), m.view().tobytes())
+                    s = os.stat(filepath)
+                    self.assertEqual(s.st_mode, m.mode)
+                    self.assertEqual(s.st_mtime, m.date)
+
+    def test_parallel_save(self):
+        def save(arc, name, workers):
+            outpath = os.path.join(self.temp_dir, name)
+            arc.save(outpath, workers=workers)
+            arc.outstream.close()
+            with open(outpath, "rb") as f:
+                return f.read()
+
+        for path in ["test_subjects/gnu1.a", "test_subjects/bsd1.a", "test_subjects/test.deb"]:
+            for use_mmap in [False, True]:
+                arc = arlib.Archive()
+                arc.load(path)
+                expected = save(arc, "sequential.a", 1)
+                arc = arlib.Archive()
+                arc.load(path, use_mmap=use_mmap)
+                self.assertEqual(save(arc, "parallel.a", 4), expected)
+
+        for fmt in [arlib.GNU, arlib.BSD]:
+            archives = []
+            for workers in [1, 4]:
+                c = arlib.Archive(format=fmt)
+                for name in sorted(os.listdir("test_subjects/source")):
+                    c.add(os.path.join("test_subjects/source", name))
+                archives.append(save(c, "created.a", workers))
+            self.assertEqual(archives[1], archives[0])
+
+        # The computed layout of a loaded archive is the one it was read from.
+        arc = arlib.Archive()
+        arc.load("test_subjects/bsd1.a")
+        members = [arc.symbols] + list(arc.members)
+        slots, end = arc.layout(members)
+        self.assertEqual([payload for pos, payload, stop in slots], [m.offset for m in members])
+        self.assertEqual(end, os.path.getsize("test_subjects/bsd1.a"))
+
+    def test_concurrent_reads(self):
+        with open("test_subjects/gnu1.a", "rb") as f:
+            data = f.read()
+        expected = {}
+        arc = arlib.Archive()
+        arc.load(io.BytesIO(data))
+        for m in arc:
+            expected[m.filename] = m.view().tobytes()
+
+        sources = [
+            ("test_subjects/gnu1.a", {}, arlib.FileReader if arlib._pread_into is not None else arlib.StreamReader),
+            ("test_subjects/gnu1.a", {"use_mmap": True}, arlib.MappedReader),
+            (io.BytesIO(data), {}, arlib.StreamReader),
+            (io.BytesIO(data), {"reader": arlib.StreamReader}, arlib.StreamReader),
+        ]
+        for source, kwargs, reader in sources:
+            arc = arlib.Archive()
+            arc.load(source, **kwargs)
+            self.assertIsInstance(arc.reader, reader)
+            members = list(arc) * 20
+            pool = ThreadPool(8)
+            try:
+                results = pool.map(lambda m: (m.filename, m.view().tobytes()), members)
+            finally:
+                pool.close()
+                pool.join()
+            for filename, content in results:
+                self.assertEqual(content, expected[filename])
+
+    def test_streaming_from_pipe(self):
+        sources = []
+        for path in ["test_subjects/gnu1.a", "test_subjects/bsd1.a", "test_subjects/test.deb"]:
+            with open(path, "rb") as f:
+                sources.append(f.read())
+        # An odd-sized payload is followed by a padding byte.
+        sources.append(b"!<arch>\n" + member_header("odd.txt/", 3) + b"abc\n" + member_header("even.txt/", 2) + b"de")
+        for data in sources:
+            arc = arlib.Archive()
+            arc.load(io.BytesIO(data))
+            expected = [(m.filename, m.view().tobytes()) for m in arc]
+
+            rfd, wfd = os.pipe()
+            writer = threading.Thread(target=lambda: (os.write(wfd, data), os.close(wfd)))
+            writer.start()
+            with os.fdopen(rfd, "rb") as pipe:
+                streamed = arlib.Archive()
+                contents = []
+                for m in streamed.stream(pipe):
+                    with m.open() as f:
+                        contents.append((m.filename, f.read()))
+                self.assertEqual(contents, expected)
+                self.assertEqual(streamed.format, arc.format)
+                self.assertRaises(io.UnsupportedOperation, streamed.members[0].view)
+            writer.join()
+
+    def test_opening_members(self):
+        if lzma is not None:
+            arc = arlib.Archive()
+            arc.load("test_subjects/test.deb")
+            with arc["data.tar.xz"].open() as f:
+                with tarfile.open(fileobj=f) as tar:
+                    self.assertTrue(tar.getnames())
+
+        for use_mmap in [False, True]:
+            arc = arlib.Archive()
+            arc.load("test_subjects/gnu1.a", use_mmap=use_mmap)
+            m = arc["this_is_a_long_file_name.o"]
+            with m.open() as f:
+                self.assertTrue(f.seekable())
+                self.assertEqual(f.read(4), b"\x7fELF")
+                self.assertEqual(f.seek(-4, io.SEEK_END), m.filesize - 4)
+                self.assertEqual(f.read(), m.view().tobytes()[-4:])
+                self.assertEqual(f.read(), b"")
+                f.seek(0)
+                buf = bytearray(16)
+                self.assertEqual(f.readinto(buf), 16)
+                self.assertEqual(bytes(buf), m.view().tobytes()[:16])
+                f.seek(0)
+                self.assertEqual(f.read(), m.view().tobytes())
+
+    def test_iter_headers(self):
+        for path in ["test_subjects/gnu1.a", "test_subjects/bsd1.a", "test_subjects/test.deb"]:
+            arc = arlib.Archive()
+            arc.load(path)
+            expected = [(m.filename, m.offset, m.filesize, m.date, m.uid, m.gid, m.mode) for m in arc]
+            self.assertEqual([tuple(info) for info in arlib.iter_headers(path)], expected)
+            with open(path, "rb") as f:
+                self.assertEqual([tuple(info) for info in arlib.iter_headers(io.BytesIO(f.read()))], expected)
+
+        info = next(arlib.iter_headers("test_subjects/test.deb", decode=False))
+        self.assertEqual(info.name, "debian-binary")
+        self.assertEqual(info.size, 4)
+        self.assertEqual(info.mode, b"100644")
+
+        # Archives after the start of a file report offsets in the file, mapped or read.
+        with open("test_subjects/gnu1.a", "rb") as f:
+            data = f.read()
+        path = os.path.join(self.temp_dir, "embedded.a")
+        with open(path, "wb") as f:
+            f.write(b"xx" + data)
+        arc = arlib.Archive()
+        arc.load("test_subjects/gnu1.a")
+        expected = [(m.filename, m.offset + 2) for m in arc]
+        with open(path, "rb") as f:
+            f.seek(2)
+            self.assertEqual([(info.name, info.offset) for info in arlib.iter_headers(f)], expected)
+        stream = io.BytesIO(b"xx" + data)
+        stream.seek(2)
+        self.assertEqual([(info.name, info.offset) for info in arlib.iter_headers(stream)], expected)
+
+        offset = data.index(b"zeta.o/") + 16
+        for field, value in [(0, b"14180033x8"), (34, b"99x")]:
+            corrupt = data[:offset + field] + value + data[offset + field + len(value):]
+            self.assertRaises(arlib.InvalidArchiveException, list, arlib.iter_headers(io.BytesIO(corrupt)))
+
+    def test_index_cache(self):
+        path = os.path.join(self.temp_dir, "gnu1.a")
+        shutil.copy("test_subjects/gnu1.a", path)
+        cachedir = os.path.join(self.temp_dir, "cache")
+        os.mkdir(cachedir)
+
+        arc = arlib.Archive()
+        arc.load(path, index_cache=cachedir)
+        expected = [(m.filename, m.offset, m.view().tobytes()) for m in arc]
+        indexes = os.listdir(cachedir)
+        self.assertEqual(len(indexes), 1)
+        indexpath = os.path.join(cachedir, indexes[0])
+
+        arc = arlib.Archive()
+        arc.load(path, index_cache=cachedir)
+        self.assertEqual([(m.filename, m.offset, m.view().tobytes()) for m in arc], expected)
+        self.assertEqual(arc.format, arlib.GNU)
+        self.assertIsInstance(arc.symbols, arlib.GNUSymbolTable)
+
+        # The symbol map comes from the index without reading the table,
+        # and is only resolved once it is used.
+        self.assertIsNone(arc.symbols._symbols)
+        read_at = arc.reader.read_at
+        arc.reader.read_at = None
+        try:
+            self.assertIs(arc.symbols.find("a_function"), arc["test.o"])
+        finally:
+            arc.reader.read_at = read_at
+
+        # Sorted BSD tables from the index are still searched by bisection.
+        bsdpath = os.path.join(self.temp_dir, "bsd1.a")
+        shutil.copy("test_subjects/bsd1.a", bsdpath)
+        for i in range(2):
+            bsd = arlib.Archive()
+            bsd.load(bsdpath, index_cache=True)
+        read_at = bsd.reader.read_at
+        bsd.reader.read_at = None
+        try:
+            self.assertIs(bsd.symbols.find("_a_function"), bsd["test.o"])
+            self.assertIsNone(bsd.symbols._symbols)
+        finally:
+            bsd.reader.read_at = read_at
+
+        # The index is used as long as the archive is unchanged...
+        with open(indexpath) as f:
+            index = f.read()
+        with open(indexpath, "w") as f:
+            f.write(index.replace("alpha.o/", "omega.o/"))
+        arc = arlib.Archive()
+        arc.load(path, index_cache=cachedir)
+        self.assertEqual(arc.members[0].filename, "omega.o")
+
+        # ...with the same decoding...
+        arc = arlib.Archive(errors="surrogateescape")
+        arc.load(path, index_cache=cachedir)
+        self.assertEqual(arc.members[0].filename, "alpha.o")
+        arc = arlib.Archive()
+        arc.load(path, index_cache=cachedir)
+        self.assertEqual(arc.members[0].filename, "alpha.o")
+        with open(indexpath, "w") as f:
+            f.write(index.replace("alpha.o/", "omega.o/"))
+
+        # Loading from the index reads nothing from the archive, the string
+        # table included, in either mode.
+        with open(indexpath, "w") as f:
+            f.write(index)
+        reads = []
+        class RecordingReader(arlib.StreamReader):
+            def read_at(self, offset, length):
+                reads.append((offset, length))
+                return super(RecordingReader, self).read_at(offset, length)
+        arc = arlib.Archive()
+        arc.load(path)
+        resaved = io.BytesIO()
+        arc.save(resaved)
+        for compact in [False, True]:
+            arc = arlib.Archive()
+            arc.load(path, index_cache=cachedir, reader=RecordingReader, compact=compact)
+            self.assertEqual([m.filename for m in arc], [filename for filename, offset, content in expected])
+            self.assertEqual(reads, [])
+            out = io.BytesIO()
+            arc.save(out)
+            self.assertTrue(out.getvalue() == resaved.getvalue())
+            del reads[:]
+
+        # An index whose members cannot be created is not used.
+        self.assertIn('"100644"', index)
+        with open(indexpath, "w") as f:
+            f.write(index.replace('"100644"', '"10x644"'))
+        arc = arlib.Archive()
+        arc.load(path, index_cache=cachedir)
+        self.assertEqual([(m.filename, m.offset, m.view().tobytes()) for m in arc], expected)
+        self.assertEqual(arc.format, arlib.GNU)
+        with open(indexpath, "w") as f:
+            f.write(index.replace("alpha.o/", "omega.o/"))
+
+        # ...and rebuilt once it changes.
+        os.utime(path, (0, 0))
+        arc = arlib.Archive()
+        arc.load(path, index_cache=True)
+        arc.load(path, index_cache=cachedir)
+        self.assertEqual(arc.members[0].filename, "alpha.o")
+        self.assertTrue(os.path.exists(path + ".arindex"))
+
+    def test_compact_member_table(self):
+        # An archive whose first member has a long name.
+        longfirst = os.path.join(self.temp_dir, "longfirst.a")
+        c = arlib.Archive(format=arlib.GNU)
+        c.add("test_subjects/source/this_is_a_long_file_name.c")
+        c.add("test_subjects/source/zeta.c")
+        c.save(longfirst)
+        c.outstream.close()
+
+        for path in ["test_subjects/gnu1.a", "test_subjects/bsd1.a", "test_subjects/test.deb", longfirst]:
+            arc = arlib.Archive()
+            arc.load(path)
+            expected = [repr(m) for m in arc]
+            compact = arlib.Archive()
+            compact.load(path, compact=True)
+            self.assertIsInstance(compact.members, arlib.MemberTable)
+            self.assertEqual(compact.format, arc.format)
+            self.assertEqual([repr(m) for m in compact], expected)
+
+            # Saving without touching the members keeps the long names.
+            compact = arlib.Archive()
+            compact.load(path, compact=True)
+            out = io.BytesIO()
+            compact.save(out)
+            out.seek(0)
+            d = arlib.Archive()
+            d.load(out)
+            self.assertEqual([repr(m) for m in d], expected)
+
+        # The table behaves like the list of a default load.
+        arc = arlib.Archive()
+        arc.load("test_subjects/gnu1.a")
+        compact = arlib.Archive()
+        compact.load("test_subjects/gnu1.a", compact=True)
+        for archive in [arc, compact]:
+            members = archive.members
+            self.assertEqual([m.filename for m in members[1:3]], ["another_long_file_name.o", "test.o"])
+            members.insert(0, members.pop())
+            members.insert(-1, members.pop(2))
+            del members[1:2]
+            self.assertEqual([m.filename for m in members],
+                             ["zeta.o", "test.o", "another_long_file_name.o", "this_is_a_long_file_name.o"])
+            self.assertEqual(archive["test.o"].filename, "test.o")
+            members.sort(key=lambda m: m.filename)
+            self.assertEqual([m.filename for m in members],
+                             ["another_long_file_name.o", "test.o", "this_is_a_long_file_name.o", "zeta.o"])
+            self.assertEqual(archive["zeta.o"].filename, "zeta.o")
+        out = io.BytesIO()
+        compact.save(out)
+        out.seek(0)
+        d = arlib.Archive()
+        d.load(out)
+        self.assertEqual([m.filename for m in d], [m.filename for m in arc])
+
+        arc = arlib.Archive()
+        arc.load("test_subjects/gnu1.a", compact=True)
+        member = arc["this_is_a_long_file_name.o"]
+        self.assertIs(arc["this_is_a_long_file_name.o"], member)
+        arc.remove(arc["alpha.o"])
+        self.assertEqual([m.filename for m in arc],
+                         ["another_long_file_name.o", "test.o", "this_is_a_long_file_name.o", "zeta.o"])
+        arc.add("test_subjects/source/alpha.c")
+        arc.save(os.path.join(self.temp_dir, "gnu.a"))
+        arc.outstream.close()
+        d = arlib.Archive()
+        d.load(os.path.join(self.temp_dir, "gnu.a"))
+        self.assertEqual([m.filename for m in d],
+                         ["another_long_file_name.o", "test.o", "this_is_a_long_file_name.o", "zeta.o", "alpha.c"])
+
+    def test_compact_member_table_memory(self):
+        if tracemalloc is None:
+            self.skipTest("tracemalloc is not available")
+        data = b"!<arch>\n" + b"".join(
+            member_header("obj%05d.o/" % i, 2, 1418003358, 501, 20) + b"ab" for i in range(5000))
+
+        used = []
+        logger = logging.getLogger("arlib")
+        level = logger.level
+        logger.setLevel(logging.WARNING)
+        try:
+            for compact in [False, True]:
+                gc.collect()
+                tracemalloc.start()
+                arc = arlib.Archive()
+                arc.load(io.BytesIO(data), compact=compact)
+                # A lookup indexes every member.
+                self.assertEqual(arc["obj02500.o"].offset, 8 + 2501 * 60 + 2500 * 2)
+                used.append(tracemalloc.get_traced_memory()[0])
+                tracemalloc.stop()
+                del arc
+        finally:
+            logger.setLevel(level)
+        self.assertLess(used[1] * 5, used[0])
+
     def test_creating_bsd_archive(self):
         c = arlib.Archive(format=arlib.BSD)
         c.add("test_subjects/source/alpha.c")
@@ -83,6 +986,123 @@ class ArLibTestCase(unittest.TestCase):
         c.add("test_subjects/source/zeta.c")
         c.save(os.path.join(self.temp_dir, "bsd.a"))
 
+    def test_creating_gnu_archive(self):
+        c = arlib.Archive(format=arlib.GNU)
+        c.add("test_subjects/source/alpha.c")
+        c.add("test_subjects/source/another_long_file_name.c")
+        c.add("test_subjects/source/test.c")
+        c.add("test_subjects/source/this_is_a_long_file_name.c")
+        c.add("test_subjects/source/zeta.c")
+        self.assertEqual(c.strings.size, len(b"another_long_file_name.c/\nthis_is_a_long_file_name.c/\n"))
+        self.assertEqual(c["this_is_a_long_file_name.c"].name, "/26")
+        c.save(os.path.join(self.temp_dir, "gnu.a"))
+        c.outstream.close()
+
+        d = arlib.Archive()
+        d.load(os.path.join(self.temp_dir, "gnu.a"))
+        filenames = [m.filename for m in d]
+        expected = ["alpha.c", "another_long_file_name.c", "test.c", "this_is_a_long_file_name.c", "zeta.c"]
+        self.assertEqual(filenames, expected)
+
+        # Removing an entry shifts the offsets of the entries after it.
+        removed = d["another_long_file_name.c"]
+        member = d["this_is_a_long_file_name.c"]
+        d.remove(removed)
+        self.assertEqual(member.name, "/0")
+        self.assertEqual(d.strings.size, len(b"this_is_a_long_file_name.c/\n"))
+
+    def test_header_field_widths(self):
+        c = arlib.Archive(format=arlib.GNU)
+        c.add("test_subjects/source/alpha.c")
+        member = c["alpha.c"]
+        member.uid, member.gid, member.date, member.mode = 999999, 0, 1234567890, 0o100644
+        header = bytearray(60)
+        member.pack_header(header)
+        self.assertEqual(bytes(header[:48]), b"alpha.c/        1234567890  999999" + b"0".ljust(6) + b"100644  ")
+        self.assertEqual(bytes(header[58:]), b"`\n")
+
+        outpath = os.path.join(self.temp_dir, "overflow.a")
+        for field, value in [("uid", 1000000), ("size", 10 ** 10), ("mode", 0o100000000), ("date", -1)]:
+            previous = getattr(member, field)
+            setattr(member, field, value)
+            with open(outpath, "wb") as f:
+                self.assertRaises(arlib.InvalidArchiveException, c.save, f)
+                self.assertEqual(f.tell(), 0)
+            setattr(member, field, previous)
+
+    def test_duplicate_member_names(self):
+        c = arlib.Archive(format=arlib.GNU)
+        c.add("test_subjects/source/test.c")
+        c.add("test_subjects/source/this_is_a_long_file_name.c")
+        c.add("test_subjects/source/test.c")
+        first, second = c.members[0], c.members[2]
+        self.assertIs(c["test.c"], first)
+        self.assertIs(c.get("test.c", count=2), second)
+        self.assertIs(c.get("test.c", count=3), None)
+        self.assertIs(c.get("missing.c"), None)
+
+        del c["test.c"]
+        self.assertIs(c["test.c"], second)
+        self.assertEqual(len(c), 2)
+
+        c.remove(c["this_is_a_long_file_name.c"])
+        self.assertEqual(len(c.strings), 0)
+        self.assertRaises(KeyError, c.__getitem__, "this_is_a_long_file_name.c")
+
+    def test_renaming_and_removing_members(self):
+        # A member table is indexed one row at a time or, past the overflow
+        # limit, by sorting every row on the hash of its name.
+        for compact, overflow in [(False, None), (True, 64), (True, 0)]:
+            arc = arlib.Archive()
+            if overflow is not None:
+                arc._index_overflow = overflow
+            arc.load("test_subjects/gnu1.a", compact=compact)
+            m = arc["alpha.o"]
+            m.filename = "renamed.o"
+            self.assertIs(arc["renamed.o"], m)
+            self.assertRaises(KeyError, arc.__getitem__, "alpha.o")
+            arc["zeta.o"].filename = "test.o"
+            self.assertEqual([arc.get("test.o", count=i).offset for i in (1, 2)],
+                             sorted(m.offset for m in arc if m.filename == "test.o"))
+            m.filename = "alpha.o"
+            self.assertIs(arc["alpha.o"], m)
+            self.assertIs(arc.get("alpha.o", count=2), None)
+            self.assertRaises(KeyError, arc.__getitem__, "renamed.o")
+
+            arc = arlib.Archive()
+            if overflow is not None:
+                arc._index_overflow = overflow
+            arc.load("test_subjects/gnu1.a", compact=compact)
+            for filename in ["test.o", "alpha.o", "zeta.o"]:
+                arc.remove(arc[filename])
+                self.assertRaises(KeyError, arc.__getitem__, filename)
+                for m in arc:
+                    self.assertIs(arc[m.filename], m)
+            self.assertEqual([m.filename for m in arc], ["another_long_file_name.o", "this_is_a_long_file_name.o"])
+            arc.add("test_subjects/source/alpha.c")
+            self.assertEqual(arc["alpha.c"].filename, "alpha.c")
+
+    def test_lookup_after_reordering(self):
+        arc = arlib.Archive()
+        arc.load("test_subjects/gnu1.a")
+        self.assertEqual(arc["alpha.o"].filename, "alpha.o")
+        arc.members.sort(key=lambda m: m.filename, reverse=True)
+        self.assertEqual(arc["zeta.o"].filename, "zeta.o")
+        arc.members.insert(0, arc.members.pop())
+        for m in list(arc):
+            self.assertIs(arc[m.filename], m)
+
+        # Positions in a member table are checked against the table.
+        for overflow in [64, 0]:
+            arc = arlib.Archive()
+            arc._index_overflow = overflow
+            arc.load("test_subjects/gnu1.a", compact=True)
+            self.assertEqual(arc["zeta.o"].filename, "zeta.o")
+            del arc.members[0]
+            arc.add("test_subjects/source/alpha.c")
+            self.assertEqual(arc["zeta.o"].filename, "zeta.o")
+            self.assertEqual(arc["alpha.c"].filename, "alpha.c")
+
     def test_creating_deb_archive(self):
         c = arlib.Archive(format=arlib.DEB)
 